@@ -1,79 +1,297 @@
+import collections
+import functools
 import random
 
 class Card:
-    def __init__(self, color, number):
-        self.color = color
-        self.number = number
+    """Immutable card. Only one instance exists per color and number."""
+    __slots__ = ('color', 'number', 'code')
+    _instances = {}
+
+    def __new__(cls, color, number):
+        card = cls._instances.get((color, number))
+        if card is None:
+            card = object.__new__(cls)
+            object.__setattr__(card, 'color', color)
+            object.__setattr__(card, 'number', number)
+            object.__setattr__(card, 'code', COLORS.index(color) * 5 + number - 1)
+            cls._instances[(color, number)] = card
+        return card
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Card is immutable")
+
+    def __reduce__(self):
+        return (Card, (self.color, self.number))
 
     def __repr__(self):
         return f"{self.color}{self.number}"
 
-def create_deck(number_of_players):
+COLORS = ['Red', 'Blue', 'Green', 'Yellow', 'White']
+NUMBERS = [1, 1, 1, 2, 2, 3, 3, 4, 4, 5]
+
+@functools.lru_cache(maxsize=None)
+def deck_cards(number_of_players):
+    """Returns every card of a game for the given number of players, in order."""
+    return tuple(Card(color, number) for color in COLORS[:number_of_players] for number in NUMBERS)
+
+@functools.lru_cache(maxsize=None)
+def card_counts(number_of_players):
+    """Returns how many copies of each card a game for the given number of players holds; copy before changing it."""
+    return collections.Counter(deck_cards(number_of_players))
+
+def create_deck(number_of_players, rng=random):
     """Creates a deck of cards for the given number of players."""
-    colors = ['Red', 'Blue', 'Green', 'Yellow', 'White'][:number_of_players]
-    deck = [Card(color, number) for color in colors for number in [1, 1, 1, 2, 2, 3, 3, 4, 4, 5]]
-    random.shuffle(deck)
+    deck = list(deck_cards(number_of_players))
+    rng.shuffle(deck)
     return deck
 
+def encode_card(card):
+    """Returns the small integer code of a card: color_index * 5 + number - 1."""
+    return card.code
+
+def decode_card(code):
+    """Returns the card for an integer code."""
+    return Card(COLORS[code // 5], code % 5 + 1)
+
+# What a player knows about one of their cards is a 25-bit mask with the bit
+# of every card code it may still be. A hint narrows the masks of the cards it
+# points at to its info and removes its info from the masks of the others.
+INFO_MASKS = {color: 0b11111 << 5 * i for i, color in enumerate(COLORS)}
+INFO_MASKS.update({str(number): sum(1 << 5 * i + number - 1 for i in range(len(COLORS))) for number in range(1, 6)})
+# Hints in the order legal_actions lists them, and the bits of the hints each card code matches
+HINT_INFOS = COLORS + [str(number) for number in range(1, 6)]
+CARD_HINT_BITS = [1 << code // 5 | 1 << len(COLORS) + code % 5 for code in range(25)]
+
+def full_mask(number_of_players):
+    """Returns the mask of a card nothing is known about."""
+    return (1 << 5 * number_of_players) - 1
+
+def narrow_knowledge(masks, info, positions):
+    """Updates the masks of a hand, in place, for a hint of info at the given card letters."""
+    info_mask = INFO_MASKS[info]
+    for i in range(len(masks)):
+        masks[i] &= info_mask if chr(97 + i) in positions else ~info_mask
+
+def possible_cards(mask):
+    """Returns the cards a knowledge mask allows."""
+    return [decode_card(code) for code in range(25) if mask >> code & 1]
+
 class GameLogic:
-    def __init__(self, number_of_players):
+    """Game rules and state.
+
+    The apply_* methods form an I/O-free engine: they change the state and
+    return a list of event tuples describing what happened:
+
+    - ('play', player_id, card_index, card, success)
+    - ('draw', player_id, card_index, card)
+    - ('hint', player_id, target_player_id, info, positions)
+    - ('tokens', info_tokens, fuse_tokens)
+
+    knowledge[player_id] holds the knowledge mask of each card in that
+    player's hand, in hand order.
+
+    Invalid actions raise ValueError and leave the state untouched.
+    """
+    def __init__(self, number_of_players, seed=None, deck=None):
         self.number_of_players = number_of_players
-        self.deck = create_deck(number_of_players)
+        # the seed only shuffles the deck, so no generator is kept on the game
+        self.deck = create_deck(number_of_players, random.Random(seed)) if deck is None else list(deck)
+        self.initial_deck = tuple(self.deck)
         self.shared_tokens = {'info_tokens': number_of_players + 3, 'fuse_tokens': 3}
         self.shared_hands = {player_id: [self.deck.pop() for _ in range(5)] for player_id in range(1, number_of_players + 1)}
+        self.knowledge = {player_id: [full_mask(number_of_players)] * 5 for player_id in self.shared_hands}
+        # Indexes kept up to date on every play so rule checks never rescan
         self.played_cards = []
+        self.discard_pile = []
+        self.fireworks = {color: 0 for color in self.get_valid_colors()}
+        self.completed_colors = 0
+        self.remaining_counts = card_counts(number_of_players).copy()
+        # the mask of the cards playable now, the next card of every firework
+        self.playable = sum(1 << Card(color, 1).code for color in self.fireworks)
+        self.score = 0
         self.round = 1
+        self.current_player = 1
 
     def show_other_players_hands(self, player_id):
         hands_display = "\n".join(f"Player {id}: {', '.join(map(str, hand))}" for id, hand in self.shared_hands.items() if id != player_id)
         return hands_display
 
-    def play_card(self, player_id, card_letter):
-        """Plays a card from the given player's hand."""
-        card_index = ord(card_letter.lower()) - ord('a')
+    def apply_play(self, player_id, card_index):
+        """Plays the card at card_index and draws a replacement."""
         hand = self.shared_hands[player_id]
-        # Check if the card index is valid
         if card_index < 0 or card_index >= len(hand):
-            print("Invalid card selection. Please choose a valid card.")
-            return
+            raise ValueError(f"Invalid card selection: {card_index}")
         card = hand.pop(card_index)
-        self.played_cards.append(card)
-        # Check if the played card is valid
-        if self.is_play_valid(card):
-            print(f"Player {player_id} played {card} successfully.")
+        self.knowledge[player_id].pop(card_index)
+        success = self.is_play_valid(card)
+        if success:
+            self.played_cards.append(card)
+            self.fireworks[card.color] = card.number
+            self.playable &= ~(1 << card.code)
+            if card.number < 5:
+                self.playable |= 1 << card.code + 1
+            self.score += 1
             if card.number == 5:
-                self.shared_tokens['info_tokens'] += 1  
+                self.completed_colors += 1
+                self.shared_tokens['info_tokens'] += 1
         else:
-            print(f"Player {player_id} played {card}, but it was not valid.")
-            self.shared_tokens['fuse_tokens'] -= 1  
+            self.discard_pile.append(card)
+            self.shared_tokens['fuse_tokens'] -= 1
+        self.remaining_counts[card] -= 1
+        events = [('play', player_id, card_index, card, success)]
+        if not success or card.number == 5:
+            events.append(('tokens', self.shared_tokens['info_tokens'], self.shared_tokens['fuse_tokens']))
         # Draw a new card from the deck to replace the played card
         if self.deck:
             new_card = self.deck.pop()
             hand.insert(card_index, new_card)
+            self.knowledge[player_id].insert(card_index, full_mask(self.number_of_players))
+            events.append(('draw', player_id, card_index, new_card))
+        return events
+
+    def apply_hint(self, player_id, target_player_id, info):
+        """Tells target_player_id which of their cards match info."""
+        if self.shared_tokens['info_tokens'] <= 0:
+            raise ValueError("No information tokens available.")
+        if target_player_id == player_id or target_player_id not in self.shared_hands:
+            raise ValueError(f"Invalid target player: {target_player_id}")
+        positions = self.get_informed_cards(target_player_id, info)
+        if not positions:
+            raise ValueError(f"No cards of player {target_player_id} match {info}.")
+        self.shared_tokens['info_tokens'] -= 1
+        narrow_knowledge(self.knowledge[target_player_id], info, positions)
+        return [('hint', player_id, target_player_id, info, positions),
+                ('tokens', self.shared_tokens['info_tokens'], self.shared_tokens['fuse_tokens'])]
+
+    def apply_action(self, player_id, action):
+        """Applies ('play', card_index) or ('hint', target_player_id, info)."""
+        if action[0] == 'play':
+            return self.apply_play(player_id, action[1])
+        if action[0] == 'hint':
+            return self.apply_hint(player_id, action[1], action[2])
+        raise ValueError(f"Unknown action: {action}")
+
+    def step(self, action):
+        """Applies an action for the current player and passes the turn on."""
+        events = self.apply_action(self.current_player, action)
+        self.advance_turn()
+        return events
+
+    def apply(self, action):
+        """Like step, but returns an undo record that undo() can revert."""
+        # a hint cannot be undone from its event, so keep the masks it changes
+        owner = action[1] if action[0] == 'hint' else self.current_player
+        knowledge = list(self.knowledge.get(owner, ()))
+        record = (self.current_player, self.round, self.apply_action(self.current_player, action), owner, knowledge)
+        self.advance_turn()
+        return record
+
+    def undo(self, record):
+        """Reverts the action of an undo record returned by apply, in place."""
+        player_id, self.round, events, owner, knowledge = record
+        self.current_player = player_id
+        self.knowledge[owner] = knowledge
+        hand = self.shared_hands[player_id]
+        for event in reversed(events):
+            if event[0] == 'draw':
+                self.deck.append(hand.pop(event[2]))
+            elif event[0] == 'play':
+                _, _, card_index, card, success = event
+                hand.insert(card_index, card)
+                self.remaining_counts[card] += 1
+                if success:
+                    self.played_cards.pop()
+                    self.fireworks[card.color] = card.number - 1
+                    self.playable |= 1 << card.code
+                    if card.number < 5:
+                        self.playable &= ~(1 << card.code + 1)
+                    self.score -= 1
+                    if card.number == 5:
+                        self.completed_colors -= 1
+                        self.shared_tokens['info_tokens'] -= 1
+                else:
+                    self.discard_pile.pop()
+                    self.shared_tokens['fuse_tokens'] += 1
+            elif event[0] == 'hint':
+                self.shared_tokens['info_tokens'] += 1
+
+    def clone(self):
+        """Returns an independent copy of the game state.
+
+        Cards are immutable and shared, so only the containers holding them
+        are copied.
+        """
+        copy = object.__new__(GameLogic)
+        copy.__dict__.update(self.__dict__)
+        copy.deck = self.deck.copy()
+        copy.shared_tokens = self.shared_tokens.copy()
+        copy.shared_hands = {player_id: hand.copy() for player_id, hand in self.shared_hands.items()}
+        copy.knowledge = {player_id: masks.copy() for player_id, masks in self.knowledge.items()}
+        copy.played_cards = self.played_cards.copy()
+        copy.discard_pile = self.discard_pile.copy()
+        copy.fireworks = self.fireworks.copy()
+        copy.remaining_counts = self.remaining_counts.copy()
+        return copy
+
+    def advance_turn(self):
+        """Moves to the next player, starting a new round after the last one."""
+        if self.current_player == self.number_of_players:
+            self.current_player = 1
+            self.round += 1
+        else:
+            self.current_player += 1
+
+    def legal_actions(self, player_id):
+        """Returns every action the player may take."""
+        actions = [('play', i) for i in range(len(self.shared_hands[player_id]))]
+        if self.shared_tokens['info_tokens'] > 0:
+            for target_player_id, hand in self.shared_hands.items():
+                if target_player_id == player_id:
+                    continue
+                present = 0
+                for card in hand:
+                    present |= CARD_HINT_BITS[card.code]
+                actions.extend(('hint', target_player_id, info) for bit, info in enumerate(HINT_INFOS) if present >> bit & 1)
+        return actions
+
+    def play_card(self, player_id, card_letter):
+        """Plays a card from the given player's hand."""
+        try:
+            events = self.apply_play(player_id, ord(card_letter.lower()) - ord('a'))
+        except ValueError:
+            print("Invalid card selection. Please choose a valid card.")
+            return
+        _, _, _, card, success = events[0]
+        if success:
+            print(f"Player {player_id} played {card} successfully.")
+        else:
+            print(f"Player {player_id} played {card}, but it was not valid.")
 
     def is_play_valid(self, card):
-        """Checks if the played card is valid according to game rules."""
-        if not self.played_cards:
-            return card.number == 1
-        if card.number == 1:
-            return not any(c.color == card.color and c.number == 1 for c in self.played_cards)
-        if card.number > 1:
-            last_card_played = self.played_cards[-1]
-            print(f"Last card played: {last_card_played}")
-            print(f"Played card: {card}")
-            return card.number == last_card_played.number + 1
-        return False  
+        """Checks if the card is the next one on its color's firework."""
+        return self.fireworks[card.color] == card.number - 1
+
+    def playable_mask(self):
+        """Returns the mask of the cards that are playable now."""
+        return self.playable
+
+    def is_known_playable(self, player_id, card_index):
+        """Checks if the player knows from hints alone that the card at card_index is playable."""
+        return self.knowledge[player_id][card_index] & ~self.playable == 0
+
+    def get_game_over_reason(self):
+        """Returns why the game is over, or None while it is still running."""
+        if self.completed_colors == self.number_of_players:
+            return "Game Won - All 5s have been played successfully."
+        if self.shared_tokens['fuse_tokens'] <= 0:
+            return "Game Over - All fuse tokens used up."
+        if len(self.played_cards) + len(self.discard_pile) == len(NUMBERS) * self.number_of_players:
+            return "Game Over - No cards left to play."
+        return None
 
     def is_game_over(self):
         """Checks if the game is over."""
-        num_fives = sum(1 for card in self.played_cards if card.number == 5)
-        if num_fives == self.number_of_players:
-            print("Game Won - All 5s have been played successfully.")
-            return True
-        if self.shared_tokens['fuse_tokens'] <= 0:
-            print("Game Over - All fuse tokens used up.")
-            return True
-        return False
+        return self.get_game_over_reason() is not None
 
     def get_player_action(self):
         """Gets and validates the player's action."""
@@ -94,16 +312,15 @@ class GameLogic:
         while True:
             target_player_id = self.get_target_player_id(current_player_id)
             info = self.get_information_type()
-            informed_cards = self.get_informed_cards(target_player_id, info)
-
-            if informed_cards:
-                self.shared_tokens['info_tokens'] -= 1
-                card_positions = ', '.join(informed_cards).lower()
-                print(f"Player {target_player_id}, your cards {card_positions} are {info}.")
-                print(f"Information tokens left: {self.shared_tokens['info_tokens']}")
-                break
-            else:
+            try:
+                events = self.apply_hint(current_player_id, target_player_id, info)
+            except ValueError:
                 print("Invalid information. Please try again.")
+                continue
+            card_positions = ', '.join(events[0][4]).lower()
+            print(f"Player {target_player_id}, your cards {card_positions} are {info}.")
+            print(f"Information tokens left: {self.shared_tokens['info_tokens']}")
+            break
 
     def get_target_player_id(self, current_player_id):
         """Gets a valid target player ID for giving information."""
@@ -130,7 +347,7 @@ class GameLogic:
 
     def get_valid_colors(self):
         """Returns a list of valid colors used in the game."""
-        return ['Red', 'Blue', 'Green', 'Yellow', 'White'][:self.number_of_players]
+        return COLORS[:self.number_of_players]
 
     def get_information_type(self):
         """Gets and validates the information type."""
@@ -163,6 +380,7 @@ class GameLogic:
                 if self.is_game_over():
                     break
             self.round += 1
+        print(self.get_game_over_reason())
         print("Game concluded.")
 
 def get_number_of_players(min_players=2, max_players=5):
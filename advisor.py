@@ -0,0 +1,218 @@
+import argparse
+import collections
+import concurrent.futures
+import os
+import random
+import time
+import Hannabis as h
+import simulator
+
+# The advisor scores each legal action of a player by the mean final score of
+# rollouts. Every rollout starts from a determinization: the player's own hand
+# and the deck are replaced by a random deal of the cards the player cannot
+# see, fitting what they know of their hand. Rollouts follow a simple
+# convention: a hinted card that was playable when hinted gets played,
+# otherwise a player hints a playable card if a token is left, and plays a
+# random card as a last resort.
+
+TT_SIZE = 200000
+TT_SAMPLES = 4
+# Transposition table of this process: state key -> [total score, rollouts]
+transpositions = {}
+
+def determinize(game, player_id, rng):
+    """Returns a copy of game with player_id's hand and the deck dealt at random from the cards they cannot see.
+
+    Each card of the hand is dealt from the cards its knowledge mask allows.
+    """
+    sample = game.clone()
+    visible = collections.Counter(card for id, hand in game.shared_hands.items() if id != player_id for card in hand)
+    hidden = list((game.remaining_counts - visible).elements())
+    rng.shuffle(hidden)
+    picks = deal_hand(game.knowledge[player_id], hidden)
+    if picks is None:
+        raise ValueError(f"No deal of the unseen cards fits what player {player_id} knows.")
+    sample.shared_hands[player_id] = [hidden[i] for i in picks]
+    for i in sorted(picks, reverse=True):
+        hidden.pop(i)
+    sample.deck = hidden
+    return sample
+
+def deal_hand(masks, hidden):
+    """Returns an index into hidden for each mask so that every card fits its mask, or None if no deal does.
+
+    Slots with the fewest fitting cards are dealt first, backtracking when a
+    later slot is left with none; hidden is shuffled, so the deal is random.
+    """
+    fits = [[i for i, card in enumerate(hidden) if mask >> card.code & 1] for mask in masks]
+    order = sorted(range(len(masks)), key=lambda slot: len(fits[slot]))
+    picks = [None] * len(masks)
+    used = set()
+
+    def fill(k):
+        if k == len(order):
+            return True
+        slot = order[k]
+        tried = set()
+        for i in fits[slot]:
+            # another copy of a card that did not work will not work either
+            if i in used or hidden[i] in tried:
+                continue
+            tried.add(hidden[i])
+            used.add(i)
+            picks[slot] = i
+            if fill(k + 1):
+                return True
+            used.discard(i)
+        return False
+
+    return picks if fill(0) else None
+
+def state_key(game, marks):
+    """Returns a compact bytes key of everything that decides how a rollout continues."""
+    key = bytearray(h.encode_card(card) for card in game.deck)
+    for player_id, hand in game.shared_hands.items():
+        key.append(255)
+        key.extend(h.encode_card(card) | (marks[player_id][i] << 7) for i, card in enumerate(hand))
+    key.extend((255, game.shared_tokens['info_tokens'], game.shared_tokens['fuse_tokens'], game.current_player))
+    key.extend(game.fireworks.values())
+    return bytes(key)
+
+def apply_marked(game, player_id, action, marks):
+    """Applies an action and keeps the hinted-playable marks aligned with the hands."""
+    events = game.apply_action(player_id, action)
+    if action[0] == 'hint':
+        target = marks[action[1]]
+        for letter in events[0][4]:
+            index = ord(letter) - ord('a')
+            if game.is_play_valid(game.shared_hands[action[1]][index]):
+                target[index] = True
+    else:
+        hand_marks = marks[player_id]
+        hand_marks.pop(action[1])
+        if any(event[0] == 'draw' for event in events):
+            hand_marks.insert(action[1], False)
+
+def rollout_action(game, player_id, marks, rng):
+    """Picks the move of the rollout convention, or None to pass."""
+    hand_marks = marks[player_id]
+    if True in hand_marks:
+        return ('play', hand_marks.index(True))
+    if game.shared_tokens['info_tokens'] > 0:
+        for target_player_id, hand in game.shared_hands.items():
+            if target_player_id == player_id:
+                continue
+            for i, card in enumerate(hand):
+                if not marks[target_player_id][i] and game.is_play_valid(card):
+                    return ('hint', target_player_id, str(card.number) if rng.random() < 0.5 else card.color)
+    if game.shared_hands[player_id]:
+        return ('play', rng.randrange(len(game.shared_hands[player_id])))
+    actions = game.legal_actions(player_id)
+    return rng.choice(actions) if actions else None
+
+def rollout(game, marks, rng):
+    """Plays the game out with the rollout convention and returns the final score."""
+    while not game.is_game_over():
+        game.advance_turn()
+        player_id = game.current_player
+        action = rollout_action(game, player_id, marks, rng)
+        if action is not None:
+            apply_marked(game, player_id, action, marks)
+    return game.score
+
+def evaluate_action(sample, player_id, action, rng):
+    """Returns the score of one rollout after player_id takes action in a determinization."""
+    game = sample.clone()
+    # cards hints have already shown to be playable count as marked
+    playable = game.playable_mask()
+    marks = {id: [mask & ~playable == 0 for mask in masks] for id, masks in game.knowledge.items()}
+    apply_marked(game, player_id, action, marks)
+    key = state_key(game, marks)
+    entry = transpositions.get(key)
+    if entry is not None and entry[1] >= TT_SAMPLES:
+        return entry[0] / entry[1]
+    score = rollout(game, marks, rng)
+    if entry is None:
+        if len(transpositions) >= TT_SIZE:
+            transpositions.clear()
+        entry = transpositions[key] = [0, 0]
+    entry[0] += score
+    entry[1] += 1
+    return score
+
+def evaluate_chunk(game, player_id, actions, deadline, seed):
+    """Evaluates every action on fresh determinizations until the deadline and returns (totals, counts)."""
+    rng = random.Random(seed)
+    totals = [0.0] * len(actions)
+    counts = [0] * len(actions)
+    while True:
+        sample = determinize(game, player_id, rng)
+        for i, action in enumerate(actions):
+            # every action gets at least one rollout, however short the budget
+            if counts[-1] and time.time() >= deadline:
+                return totals, counts
+            totals[i] += evaluate_action(sample, player_id, action, rng)
+            counts[i] += 1
+
+
+class Advisor:
+    """Scores a player's legal actions with determinized rollouts spread across a process pool."""
+    def __init__(self, workers=None, budget_ms=100, seed=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.budget_ms = budget_ms
+        self.rng = random.Random(seed)
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+
+    def evaluate(self, game, player_id, budget_ms=None):
+        """Returns [(action, mean score, rollouts)] for every legal action, best first."""
+        actions = game.legal_actions(player_id)
+        if not actions:
+            return []
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        # leave a little of the budget for collecting the results
+        deadline = time.time() + budget_ms * 0.9 / 1000
+        seeds = [self.rng.getrandbits(64) for _ in range(self.workers)]
+        if self.executor is None:
+            results = [evaluate_chunk(game, player_id, actions, deadline, seeds[0])]
+        else:
+            futures = [self.executor.submit(evaluate_chunk, game, player_id, actions, deadline, seed) for seed in seeds]
+            results = [future.result() for future in futures]
+        totals = [sum(result[0][i] for result in results) for i in range(len(actions))]
+        counts = [sum(result[1][i] for result in results) for i in range(len(actions))]
+        scores = [(action, total / count, count) for action, total, count in zip(actions, totals, counts) if count]
+        return sorted(scores, key=lambda score: -score[1])
+
+    def best_action(self, game, player_id, budget_ms=None):
+        """Returns the action with the best mean rollout score."""
+        scores = self.evaluate(game, player_id, budget_ms)
+        return scores[0][0] if scores else None
+
+    def policy(self, game, player_id, rng):
+        """Simulator policy that plays the advisor's best action."""
+        return self.best_action(game, player_id)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Play seeded games with every player following the rollout advisor.")
+    parser.add_argument("--games", type=int, default=1, help="number of games to play")
+    parser.add_argument("--players", type=int, default=3, help="number of players per game (2-5)")
+    parser.add_argument("--budget", type=float, default=100.0, help="time budget per decision in milliseconds")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    args = parser.parse_args()
+
+    advisor = Advisor(args.workers, args.budget, args.seed)
+    try:
+        for seed in range(args.seed, args.seed + args.games):
+            started = time.perf_counter()
+            score, turns = simulator.play_game(args.players, seed, advisor.policy)
+            elapsed = time.perf_counter() - started
+            print(f"game {seed}: score {score} in {turns} turns, {elapsed * 1000 / max(turns, 1):.0f} ms per decision")
+    finally:
+        advisor.close()
+
+if __name__ == "__main__":
+    main()
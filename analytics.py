@@ -0,0 +1,452 @@
+import argparse
+import collections
+import concurrent.futures
+import json
+import math
+import os
+import shutil
+import time
+import numpy as np
+import Hannabis as h
+import event_log
+import simulator
+
+# A store is a directory holding two tables of fixed-width integer columns:
+#
+# - games: one row per finished game
+# - turns: one row per action, in game order
+#
+# Each table is split into chunks of up to CHUNK_ROWS rows and each column of
+# a chunk is one .npy file, so a query memory-maps only the columns it reads.
+# meta.json counts the chunks that are complete; anything past them is an
+# interrupted write and is never read.
+CHUNK_ROWS = 1 << 20
+GAMES_PER_TASK = 2000
+NONE = -1
+PLAY, HINT = 0, 1
+WON, FUSES, DECK = 0, 1, 2
+LOG_POLICY = "server"
+
+COLUMNS = {
+    'games': {
+        'game': np.int64, 'seed': np.int64, 'players': np.int8, 'policy': np.int8, 'score': np.int8,
+        'turns': np.int16, 'rounds': np.int16, 'info_tokens': np.int8, 'fuse_tokens': np.int8, 'outcome': np.int8,
+    },
+    # info_tokens, fuse_tokens and score are the values after the action
+    'turns': {
+        'game': np.int64, 'turn': np.int16, 'round': np.int16, 'player': np.int8, 'players': np.int8,
+        'policy': np.int8, 'action': np.int8, 'card': np.int8, 'success': np.int8, 'target': np.int8,
+        'info': np.int8, 'touched': np.int8, 'info_tokens': np.int8, 'fuse_tokens': np.int8, 'score': np.int8,
+    },
+}
+
+# Columns computed from stored ones while scanning: (stored columns, function)
+DERIVED = {
+    'color': (('card',), lambda card: np.where(card >= 0, card // 5, NONE)),
+    'number': (('card',), lambda card: np.where(card >= 0, card % 5 + 1, NONE)),
+    'misplay': (('action', 'success'), lambda action, success: (action == PLAY) & (success == 0)),
+}
+
+FILTERS = {'<=': np.less_equal, '>=': np.greater_equal, '!=': np.not_equal, '=': np.equal, '<': np.less, '>': np.greater}
+AGGREGATES = ('count', 'sum', 'mean')
+LOG_RECORD = np.dtype([('kind', 'u1'), ('player', 'u1'), ('a', 'u1'), ('b', 'u1'), ('value', '<i2'), ('extra', '<u2')])
+POPCOUNT = np.array([bin(i).count('1') for i in range(32)], dtype=np.int8)
+
+def outcome(game):
+    """Returns WON, FUSES or DECK for a finished game."""
+    if game.completed_colors == game.number_of_players:
+        return WON
+    if game.shared_tokens['fuse_tokens'] <= 0:
+        return FUSES
+    return DECK
+
+def to_columns(table, rows):
+    """Turns row tuples, in the column order of the table, into typed column arrays."""
+    names = COLUMNS[table]
+    data = np.array(rows, dtype=np.int64).reshape(len(rows), len(names))
+    return {name: data[:, i].astype(dtype) for i, (name, dtype) in enumerate(names.items())}
+
+
+class GameRecorder:
+    """Collects the rows of simulated games, numbering the games from 0."""
+    def __init__(self, policy):
+        self.policy = policy
+        self.game_rows = []
+        self.turn_rows = []
+        self.turn = 0
+        self.game = None
+
+    def observe(self, game, player_id, events):
+        """Simulator observer that adds a row for an action."""
+        self.game = game
+        event = events[0]
+        if event[0] == 'play':
+            action = (PLAY, event[3].code, int(event[4]), NONE, NONE, 0)
+        else:
+            action = (HINT, NONE, NONE, event[2], event_log.encode_info(event[3]), len(event[4]))
+        tokens = game.shared_tokens
+        self.turn_rows.append((len(self.game_rows), self.turn, game.round, player_id, game.number_of_players, self.policy,
+                               *action, tokens['info_tokens'], tokens['fuse_tokens'], game.score))
+        self.turn += 1
+
+    def finish(self, seed):
+        """Adds the row of the game observed last, once it is over."""
+        game = self.game
+        tokens = game.shared_tokens
+        # the round of the last action, as the turn has been passed on since
+        rounds = self.turn_rows[-1][2] if self.turn else game.round
+        self.game_rows.append((len(self.game_rows), seed, game.number_of_players, self.policy, game.score, self.turn,
+                               rounds, tokens['info_tokens'], tokens['fuse_tokens'], outcome(game)))
+        self.turn = 0
+        self.game = None
+
+def record_games(num_players, policy_name, policy, seeds):
+    """Plays the games for a range of seeds and returns their (games, turns) columns."""
+    recorder = GameRecorder(policy)
+    for seed in seeds:
+        simulator.play_game(num_players, seed, simulator.POLICIES[policy_name], recorder.observe)
+        recorder.finish(seed)
+    return to_columns('games', recorder.game_rows), to_columns('turns', recorder.turn_rows)
+
+def log_columns(path, policy):
+    """Returns the (games, turns) columns of a finished game log, or None if its game is still running."""
+    reader = event_log.EventLogReader(path)
+    try:
+        if not reader.is_finished():
+            return None
+        num_players = reader.number_of_players
+        records = np.frombuffer(reader.map[event_log.HEADER.size:reader.end], dtype=LOG_RECORD)
+    finally:
+        reader.close()
+    kind = records['kind']
+    index = np.arange(len(records))
+
+    def latest(mask, values, initial):
+        # the value of the last matching record at or before every record
+        last = np.maximum.accumulate(np.where(mask, index, -1))
+        return np.where(last >= 0, values[np.maximum(last, 0)], initial)
+
+    actions = np.flatnonzero((kind == event_log.PLAY) | (kind == event_log.HINT))
+    # an action's records run up to the next action; the state after it is the state at its last record
+    ends = np.append(actions[1:], len(records)) - 1
+    rounds = latest(kind == event_log.TURN, records['extra'], 1)
+    info_tokens = latest(kind == event_log.TOKENS, records['value'], num_players + 3)[ends]
+    fuse_tokens = latest(kind == event_log.TOKENS, records['extra'], 3)[ends]
+    play = kind[actions] == event_log.PLAY
+    a, b, value = records['a'][actions], records['b'][actions], records['value'][actions]
+    success = play & (value == 1)
+    score = np.cumsum(success)
+    turns = {
+        'game': np.zeros(len(actions)), 'turn': np.arange(len(actions)), 'round': rounds[actions],
+        'player': records['player'][actions], 'players': np.full(len(actions), num_players),
+        'policy': np.full(len(actions), policy), 'action': np.where(play, PLAY, HINT),
+        'card': np.where(play, b, NONE), 'success': np.where(play, value, NONE), 'target': np.where(play, NONE, a),
+        'info': np.where(play, NONE, b), 'touched': np.where(play, 0, POPCOUNT[value & 31]),
+        'info_tokens': info_tokens, 'fuse_tokens': fuse_tokens, 'score': score,
+    }
+    turns = {name: turns[name].astype(dtype) for name, dtype in COLUMNS['turns'].items()}
+    final_info = int(info_tokens[-1]) if len(actions) else num_players + 3
+    final_fuse = int(fuse_tokens[-1]) if len(actions) else 3
+    completed = int(np.count_nonzero(success & (b % 5 == 4)))
+    result = WON if completed == num_players else FUSES if final_fuse <= 0 else DECK
+    games = to_columns('games', [(0, NONE, num_players, policy, int(score[-1]) if len(actions) else 0, len(actions),
+                                  int(rounds[-1]) if len(records) else 1, final_info, final_fuse, result)])
+    return games, turns
+
+
+def chunk_path(path, table, index):
+    return os.path.join(path, table, f"{index:06d}")
+
+def read_meta(path):
+    """Returns the metadata of a store, or that of an empty one."""
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'version': 1, 'games': 0, 'policies': [], 'chunks': {table: 0 for table in COLUMNS}}
+
+
+class StoreWriter:
+    """Appends whole games to a store, writing each table a chunk at a time."""
+    def __init__(self, path, chunk_rows=CHUNK_ROWS):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        os.makedirs(path, exist_ok=True)
+        self.meta = read_meta(path)
+        self.buffers = {table: [] for table in COLUMNS}
+        self.buffered = {table: 0 for table in COLUMNS}
+
+    def policy_code(self, name):
+        """Returns the code stored for a policy name."""
+        if name not in self.meta['policies']:
+            self.meta['policies'].append(name)
+        return self.meta['policies'].index(name)
+
+    def append(self, games, turns):
+        """Adds the columns of whole games, numbered from 0, after the games already in the store."""
+        base = self.meta['games']
+        games['game'] += base
+        turns['game'] += base
+        self.meta['games'] += len(games['game'])
+        for table, columns in (('games', games), ('turns', turns)):
+            self.buffers[table].append(columns)
+            self.buffered[table] += len(columns['game'])
+            while self.buffered[table] >= self.chunk_rows:
+                self.write_chunk(table)
+
+    def write_chunk(self, table):
+        """Writes up to chunk_rows buffered rows of a table as its next chunk."""
+        columns = {name: np.concatenate([buffer[name] for buffer in self.buffers[table]]) for name in COLUMNS[table]}
+        rows = min(self.chunk_rows, self.buffered[table])
+        rest = {name: column[rows:] for name, column in columns.items()}
+        self.buffers[table] = [rest] if rows < self.buffered[table] else []
+        self.buffered[table] -= rows
+        target = chunk_path(self.path, table, self.meta['chunks'][table])
+        # a chunk left by an interrupted write is not listed in meta.json, so it is replaced
+        shutil.rmtree(target, ignore_errors=True)
+        os.makedirs(target)
+        for name, column in columns.items():
+            np.save(os.path.join(target, name + ".npy"), column[:rows])
+        self.meta['chunks'][table] += 1
+
+    def flush(self):
+        """Writes every buffered row and lists the new chunks in meta.json."""
+        for table in COLUMNS:
+            while self.buffered[table]:
+                self.write_chunk(table)
+        meta_path = os.path.join(self.path, "meta.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(self.meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+
+class Store:
+    """Scans the columns of a store chunk by chunk and aggregates them."""
+    def __init__(self, path):
+        self.path = path
+        self.meta = read_meta(path)
+
+    def columns(self, table):
+        """Returns the names of the stored and derived columns of a table."""
+        return list(COLUMNS[table]) + [name for name, (stored, _) in DERIVED.items() if set(stored) <= set(COLUMNS[table])]
+
+    def scan(self, table, names):
+        """Yields one dict per chunk of the named columns, memory-mapped or derived."""
+        stored = {name for name in names if name in COLUMNS[table]}
+        stored.update(column for name in names if name in DERIVED for column in DERIVED[name][0])
+        for index in range(self.meta['chunks'][table]):
+            directory = chunk_path(self.path, table, index)
+            chunk = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode='r') for name in stored}
+            for name in names:
+                if name in DERIVED:
+                    inputs, function = DERIVED[name]
+                    chunk[name] = function(*(chunk[column] for column in inputs))
+            yield chunk
+
+    def query(self, table, group_by=(), aggregates=(('count', None),), filters=()):
+        """Returns {group values: [aggregate values]} over every row passing the filters.
+
+        aggregates are (function, column) pairs with function in AGGREGATES,
+        and filters are (column, operator, value) triples with an operator of FILTERS.
+        """
+        values = [column for function, column in aggregates if function != 'count']
+        # a plain count still needs one column to count the rows of
+        names = list(dict.fromkeys([*group_by, *values, *(column for column, _, _ in filters)])) or ['game']
+        unknown = [name for name in names if name not in self.columns(table)]
+        if unknown:
+            raise ValueError(f"Unknown columns of {table}: {', '.join(unknown)}")
+        # every chunk is reduced to its groups, and the groups of all chunks are reduced once more at the end
+        parts = []
+        for chunk in self.scan(table, names):
+            mask = None
+            for column, operator, value in filters:
+                matches = FILTERS[operator](chunk[column], value)
+                mask = matches if mask is None else mask & matches
+            if mask is not None:
+                chunk = {name: column[mask] for name, column in chunk.items()}
+            if len(chunk[names[0]]):
+                parts.append(reduce_groups([chunk[name] for name in group_by], np.ones(len(chunk[names[0]])),
+                                           [chunk[name] for name in values]))
+        if not parts:
+            return {}
+        keys, counts, sums = reduce_groups([np.concatenate([part[0][i] for part in parts]) for i in range(len(group_by))],
+                                           np.concatenate([part[1] for part in parts]),
+                                           [np.concatenate([part[2][i] for part in parts]) for i in range(len(values))])
+        columns = []
+        sums = iter(sums)
+        for function, column in aggregates:
+            if function == 'count':
+                columns.append(counts.astype(np.int64).tolist())
+            else:
+                column_sums = next(sums)
+                # every column holds integers, so their sums do too
+                columns.append((column_sums / counts if function == 'mean' else np.rint(column_sums).astype(np.int64)).tolist())
+        groups = zip(*(key.tolist() for key in keys)) if keys else [()]
+        return dict(zip(groups, (list(row) for row in zip(*columns))))
+
+def reduce_groups(keys, weights, values):
+    """Groups rows by the key columns and returns (key columns, summed weights, summed values) per group, in key order."""
+    index, bins, keys_of = group_index(keys, len(weights))
+    counts = np.bincount(index, weights=weights, minlength=bins)
+    present = np.flatnonzero(counts)
+    sums = [np.bincount(index, weights=value, minlength=bins)[present] for value in values]
+    return keys_of(present), counts[present], sums
+
+def group_index(keys, rows):
+    """Returns (group index per row, number of groups, function from group indexes to their key columns)."""
+    if not keys:
+        return np.zeros(rows, dtype=np.intp), 1, lambda groups: []
+    lows = [int(key.min()) for key in keys]
+    spans = [int(key.max()) - low + 1 for key, low in zip(keys, lows)]
+    combined = np.zeros(rows, dtype=np.int64)
+    for key, low, span in zip(keys, lows, spans):
+        combined = combined * span + (key.astype(np.int64) - low)
+
+    def key_columns(codes):
+        return [low + digits for low, digits in zip(lows, np.unravel_index(codes, spans))]
+
+    # small key spaces are counted directly, large ones (such as game ids) are sorted first
+    if math.prod(spans) <= 1 << 22:
+        return combined, math.prod(spans), key_columns
+    codes, index = np.unique(combined, return_inverse=True)
+    return index, len(codes), lambda groups: key_columns(codes[groups])
+
+def export_simulation(path, num_games, num_players, policy_name, seed=0, workers=None, chunk_rows=CHUNK_ROWS):
+    """Plays seeded games across a process pool, appends them to the store at path and returns the elapsed seconds."""
+    workers = workers or os.cpu_count() or 1
+    writer = StoreWriter(path, chunk_rows)
+    policy = writer.policy_code(policy_name)
+    tasks = [range(start, min(start + GAMES_PER_TASK, seed + num_games)) for start in range(seed, seed + num_games, GAMES_PER_TASK)]
+    started = time.perf_counter()
+    if workers == 1:
+        for seeds in tasks:
+            writer.append(*record_games(num_players, policy_name, policy, seeds))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            # keep only a few tasks in flight so finished games are written as they come
+            pending = collections.deque()
+            for seeds in tasks:
+                pending.append(executor.submit(record_games, num_players, policy_name, policy, seeds))
+                if len(pending) >= workers * 2:
+                    writer.append(*pending.popleft().result())
+            while pending:
+                writer.append(*pending.popleft().result())
+    writer.flush()
+    return time.perf_counter() - started
+
+def import_logs(path, log_paths, chunk_rows=CHUNK_ROWS):
+    """Appends the finished games of event logs to the store at path and returns how many were added."""
+    writer = StoreWriter(path, chunk_rows)
+    policy = writer.policy_code(LOG_POLICY)
+    added = 0
+    for log_path in log_paths:
+        columns = log_columns(log_path, policy)
+        if columns is not None:
+            writer.append(*columns)
+            added += 1
+    writer.flush()
+    return added
+
+
+def labels(store, column):
+    """Returns the names of a column's codes, or None for a plain number."""
+    if column == 'policy':
+        return store.meta['policies']
+    if column == 'action':
+        return ['play', 'hint']
+    if column == 'outcome':
+        return ['won', 'fuses', 'deck']
+    if column == 'color':
+        return h.COLORS
+    if column == 'info':
+        return event_log.INFOS
+    if column == 'card':
+        return [str(h.decode_card(code)) for code in range(25)]
+    return None
+
+def format_value(store, column, value):
+    """Returns the name of a code, '-' for NONE in a named column, or the number itself."""
+    names = labels(store, column)
+    if names is None:
+        return value
+    if not 0 <= value < len(names):
+        return "-" if value == NONE else value
+    return names[value]
+
+def parse_filter(store, text):
+    """Parses 'column<operator>value', where the value may be a name such as play or Red."""
+    for operator in FILTERS:
+        column, found, value = text.partition(operator)
+        if found:
+            names = labels(store, column)
+            if names is not None and value in names:
+                return column, operator, names.index(value)
+            try:
+                return column, operator, int(value)
+            except ValueError:
+                raise ValueError(f"Invalid value in filter {text!r}") from None
+    raise ValueError(f"Invalid filter {text!r}; expected column<operator>value with one of {', '.join(FILTERS)}")
+
+def parse_aggregate(text):
+    """Parses 'count', 'sum:column' or 'mean:column'."""
+    function, _, column = text.partition(':')
+    if function not in AGGREGATES or (function == 'count') != (not column):
+        raise ValueError(f"Invalid aggregate {text!r}; expected count, sum:COLUMN or mean:COLUMN")
+    return function, column or None
+
+def main():
+    parser = argparse.ArgumentParser(description="Store finished games in columnar chunks and aggregate them.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="simulate seeded games into a store")
+    export.add_argument("store", help="store directory")
+    export.add_argument("--games", type=int, default=10000, help="number of games to play")
+    export.add_argument("--players", type=int, default=3, help="number of players per game (2-5)")
+    export.add_argument("--policy", choices=sorted(simulator.POLICIES), default="hint_playable", help="bot policy used by every player")
+    export.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    export.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    logs = commands.add_parser("import", help="add the finished games of event logs to a store")
+    logs.add_argument("store", help="store directory")
+    logs.add_argument("paths", nargs="+", help="log files to read")
+    query = commands.add_parser("query", help="aggregate a table of a store")
+    query.add_argument("store", help="store directory")
+    query.add_argument("--table", choices=sorted(COLUMNS), default="turns", help="table to scan")
+    query.add_argument("--where", action="append", default=[], help="filter such as action=play or players>=4 (repeatable)")
+    query.add_argument("--group-by", default="", help="comma-separated columns to group by")
+    query.add_argument("--agg", nargs="+", default=["count"], help="aggregates: count, sum:COLUMN or mean:COLUMN")
+    query.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        elapsed = export_simulation(args.store, args.games, args.players, args.policy, args.seed, args.workers)
+        print(f"{args.games} games exported to {args.store} in {elapsed:.2f}s ({args.games / elapsed if elapsed else 0:.0f} games/sec)")
+        return
+    if args.command == "import":
+        added = import_logs(args.store, args.paths)
+        print(f"{added} finished games of {len(args.paths)} logs imported to {args.store}")
+        return
+
+    if not os.path.exists(os.path.join(args.store, "meta.json")):
+        parser.error(f"{args.store} is not a store")
+    store = Store(args.store)
+    try:
+        filters = [parse_filter(store, text) for text in args.where]
+        aggregates = [parse_aggregate(text) for text in args.agg]
+        group_by = [name for name in args.group_by.split(",") if name]
+        started = time.perf_counter()
+        results = store.query(args.table, group_by, aggregates, filters)
+    except ValueError as e:
+        parser.error(str(e))
+    elapsed = time.perf_counter() - started
+    if args.json:
+        print(json.dumps([{**{name: format_value(store, name, value) for name, value in zip(group_by, group)},
+                           **dict(zip(args.agg, row))} for group, row in results.items()]))
+        return
+    print("\t".join(group_by + args.agg))
+    for group, row in results.items():
+        cells = [str(format_value(store, name, value)) for name, value in zip(group_by, group)]
+        cells += [str(value) if isinstance(value, int) else f"{value:.4f}" for value in row]
+        print("\t".join(cells))
+    print(f"{len(results)} groups in {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    main()
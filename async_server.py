@@ -0,0 +1,532 @@
+import asyncio
+import contextlib
+import glob
+import os
+import secrets
+import socket
+import time
+import Hannabis as h
+import commands
+import fanout
+import metrics as m
+import protocol
+from event_log import EventLogReader, EventLogWriter, unfinished_logs
+from table import Table
+
+# How long a new connection, seated as soon as it is accepted, has to send a join
+# message carrying a session token; a table only starts once its seats are past it
+JOIN_TIMEOUT = 1.0
+
+def table_log_path(log_dir, table_id):
+    """Returns the path of a table's game log."""
+    return os.path.join(log_dir, f"table-{table_id}.hlog")
+
+def table_tokens_path(log_dir, table_id):
+    """Returns the path of the session tokens of a table's seats, kept next to its log."""
+    return os.path.join(log_dir, f"table-{table_id}.tokens")
+
+def save_table_tokens(log_dir, table_id, tokens):
+    """Keeps the session token of each seat, by player ID, so the seats can be given back after a restart."""
+    with open(table_tokens_path(log_dir, table_id), "w") as f:
+        f.writelines(f"{player_id} {token}\n" for player_id, token in sorted(tokens.items()))
+
+def load_table_tokens(log_dir, table_id):
+    """Returns the session tokens saved for a table's seats, by player ID, or {} if its game never started."""
+    try:
+        with open(table_tokens_path(log_dir, table_id)) as f:
+            return {int(player_id): token for player_id, token in (line.split() for line in f if line.strip())}
+    except FileNotFoundError:
+        return {}
+
+def table_id_of(path):
+    """Returns the ID of the table whose log is at path, or None for a log not named after a table."""
+    name = os.path.basename(path)[len("table-"):-len(".hlog")]
+    return int(name) if name.isdigit() else None
+
+def logged_table_ids(log_dir):
+    """Returns the IDs of every table with a log in log_dir."""
+    table_ids = (table_id_of(path) for path in glob.glob(table_log_path(log_dir, "*")))
+    return sorted(table_id for table_id in table_ids if table_id is not None)
+
+class GameTable(Table):
+    """One game table hosted inside the shared event loop."""
+    def __init__(self, table_id, num_players, game_logic=None, event_log=None, metrics=None,
+                 turn_timeout=None, prompt_timeout=None, timeout_action=commands.default_timeout_action,
+                 spectator_policy=fanout.SNAPSHOT, reconnect_grace=30.0, bots=0, scheduler=None, spectator_hands=False):
+        super().__init__(num_players, game_logic, event_log, metrics, turn_timeout, prompt_timeout, timeout_action,
+                         spectator_policy, reconnect_grace, bots, scheduler, table_id, spectator_hands)
+        self.player_writers = {}
+        self.player_responses = {}
+        self.tokens = {}
+        # seats whose connection may still turn out to be a returning player's
+        self.settling = set()
+        self.started = False
+        self.closed = False
+        self.ended = asyncio.Event()
+
+    def is_full(self):
+        """Checks if every seat at the table is taken."""
+        return len(self.player_writers) + len(self.bot_seats) == self.num_players
+
+    def is_ready(self):
+        """Checks if every seat is taken by a player known to be new, so the game can start."""
+        return self.is_full() and not self.settling
+
+    def add_player(self, writer, token=None, player_id=None):
+        """Seats a player in the given seat, or a new one in the first free seat, and returns their player ID.
+
+        token is made up unless given.
+        """
+        if player_id is None:
+            player_id = next(id for id in range(1, self.num_players + 1) if id not in self.player_writers and id not in self.bot_seats)
+        self.player_writers[player_id] = writer
+        self.player_responses[player_id] = asyncio.Queue()
+        self.outboxes[player_id] = []
+        # the token lets them take their seat back after a disconnect
+        self.tokens[player_id] = token or secrets.token_urlsafe(16)
+        writer.write(protocol.encode_frame([protocol.make_message("session", token=self.tokens[player_id], table=self.table_id, player=player_id)]))
+        return player_id
+
+    def resume_player(self, writer, player_id):
+        """Seats a returning player again and sends them one snapshot of their view."""
+        old_writer = self.player_writers.get(player_id)
+        if old_writer is not None:
+            old_writer.close()
+        self.player_writers[player_id] = writer
+        # the connection may have been handed a new seat's token before it asked for this one
+        writer.write(protocol.encode_frame([protocol.make_message("session", token=self.tokens[player_id], table=self.table_id, player=player_id)]))
+        self.mark_reconnected(player_id)
+        self.flush()
+        self.player_responses[player_id].put_nowait(None)
+
+    async def handle_player(self, reader, player_id, decoder=None, messages=()):
+        """Reads the player's messages until the connection closes.
+
+        decoder and messages carry on from whatever was read of the connection already.
+        """
+        decoder = decoder or protocol.FrameDecoder()
+        writer = self.player_writers.get(player_id)
+        try:
+            self.receive(player_id, messages)
+            while not self.game_logic.is_game_over():
+                data = await reader.read(4096)
+                if not data:
+                    break
+                try:
+                    messages = decoder.feed(data)
+                except protocol.ProtocolError as e:
+                    self.send_message_to_player(player_id, str(e), "error")
+                    self.flush_player(player_id)
+                    continue
+                self.receive(player_id, messages)
+        except ConnectionError as e:
+            print(f"Error in handling player {player_id} at table {self.table_id}: {e}")
+        finally:
+            writer.close()
+            # unless they already came back on a new connection
+            if self.player_writers.get(player_id) is writer:
+                del self.player_writers[player_id]
+                if self.started and not self.closed:
+                    self.mark_disconnected(player_id)
+                    self.flush()
+            # wake up the turn loop if it is waiting on this player
+            self.player_responses[player_id].put_nowait(None)
+
+    def receive(self, player_id, messages):
+        """Queues the player's responses for the turn loop."""
+        for message in messages:
+            if message["type"] == "response":
+                self.player_responses[player_id].put_nowait((message.get("prompt"), message.get("text", "")))
+
+    async def start_game(self):
+        """Starts the game and handles the game logic."""
+        self.started = True
+        await self.play()
+        await self.close()
+
+    async def ask(self, player_id, prompt):
+        """Sends a prompt to a player and waits for the answer."""
+        self.prompt_player(player_id, prompt)
+        try:
+            return await self.wait_for_player_response(player_id)
+        finally:
+            del self.prompts[player_id]
+
+    async def wait_for_player_response(self, player_id):
+        """wait and return the player's next response, raising TurnTimeout after the deadline
+        and ConnectionError once a disconnected player's grace period is over"""
+        deadline = self.turn_deadline
+        if self.prompt_timeout:
+            prompt_deadline = time.monotonic() + self.prompt_timeout
+            deadline = min(deadline, prompt_deadline) if deadline else prompt_deadline
+        with self.metrics.timer("decision_seconds", table=self.table_id, player=player_id):
+            while True:
+                now = time.monotonic()
+                if deadline is not None and deadline <= now:
+                    raise commands.TurnTimeout(f"Player {player_id} did not answer in time.")
+                timeout = deadline - now if deadline else None
+                if player_id in self.disconnected:
+                    grace = self.disconnected[player_id] + self.reconnect_grace - now
+                    if grace <= 0:
+                        raise ConnectionError(f"Player {player_id} disconnected.")
+                    timeout = grace if timeout is None else min(timeout, grace)
+                try:
+                    response = await asyncio.wait_for(self.player_responses[player_id].get(), timeout)
+                except asyncio.TimeoutError:
+                    continue
+                # None only wakes the loop up after a disconnect or a reconnect
+                if response is not None and self.answers_open_prompt(player_id, response[0]):
+                    return response[1]
+
+    def discard_responses(self, player_id):
+        """empty a player's inbox"""
+        responses = self.player_responses[player_id]
+        while not responses.empty():
+            responses.get_nowait()
+
+    def flush_player(self, player_id):
+        """send a player their queued messages as one frame"""
+        messages = self.outboxes[player_id]
+        if not messages:
+            return
+        self.outboxes[player_id] = []
+        writer = self.player_writers.get(player_id)
+        if writer is None:
+            self.metrics.inc("send_failures_total", table=self.table_id, player=player_id)
+            return
+        with self.metrics.timer("send_seconds", table=self.table_id, player=player_id):
+            writer.write(protocol.encode_frame(messages))
+
+    async def close(self):
+        """close every remaining player connection"""
+        self.closed = True
+        self.flush()
+        # spectators get up to a few seconds to receive the end of the game
+        await asyncio.get_running_loop().run_in_executor(None, self.audience.close)
+        writers = list(self.player_writers.values())
+        self.player_writers.clear()
+        for writer in writers:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+        self.ended.set()
+
+
+class AsyncGameServer:
+    """Event-loop game server that hosts many tables in one process.
+
+    Spectators see no hand, unless spectator_key is set: then only spectators
+    who send that key are let in, and they see every hand.
+    """
+    def __init__(self, host, port, num_players, max_tables=None, log_dir=None, metrics=None,
+                 turn_timeout=None, prompt_timeout=None, timeout_action=commands.default_timeout_action,
+                 spectator_port=None, spectator_policy=fanout.SNAPSHOT, reconnect_grace=30.0, bots=0, scheduler=None,
+                 spectator_key=None):
+        self.metrics = metrics or m.DISABLED
+        self.bots = bots
+        self.scheduler = scheduler
+        self.reconnect_grace = reconnect_grace
+        self.sessions = {}
+        self.spectator_port = spectator_port
+        self.spectator_policy = spectator_policy
+        self.spectator_key = spectator_key
+        self.sender = None
+        self.turn_timeout = turn_timeout
+        self.prompt_timeout = prompt_timeout
+        self.timeout_action = timeout_action
+        self.host = host
+        self.port = port
+        self.num_players = num_players
+        self.max_tables = max_tables
+        self.log_dir = log_dir
+        self.tables = {}
+        self.waiting_tables = []
+        self.next_table_id = 1
+
+    def start(self):
+        """Starts the server and serves tables until interrupted."""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("Server stopped.")
+
+    async def serve(self):
+        """Accepts players and seats them at tables of num_players."""
+        print("Starting server...")
+        print(f"Seating players at tables of {self.num_players}...")
+        if self.log_dir is not None:
+            os.makedirs(self.log_dir, exist_ok=True)
+            self.resume_tables()
+            # never append a new game to an old log
+            self.next_table_id = max(logged_table_ids(self.log_dir), default=0) + 1
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port, backlog=1024)
+        if self.spectator_port is not None:
+            asyncio.create_task(self.serve_spectators())
+        async with server:
+            await server.serve_forever()
+
+    def resume_tables(self):
+        """Reopens the tables whose logs show an unfinished game.
+
+        A table whose game had started waits for its own players to come back
+        with their session tokens; one that never started takes any players.
+        """
+        for path in unfinished_logs(self.log_dir, os.path.basename(table_log_path(self.log_dir, "*"))):
+            table_id = table_id_of(path)
+            if table_id is None:
+                print(f"{path} is not named after a table. Skipped.")
+                continue
+            table = self.reopen_table(table_id)
+            if table.tokens:
+                print(f"table {table.table_id}: waiting for its players to come back")
+            else:
+                self.waiting_tables.append(table)
+                print(f"table {table.table_id}: waiting for players")
+
+    def reopen_table(self, table_id):
+        """Reopens a table at the point its log shows, to carry on with the game.
+
+        Its seats are kept for the holders of the session tokens saved when its game started.
+        """
+        path = table_log_path(self.log_dir, table_id)
+        reader = EventLogReader(path)
+        game_logic = reader.replay()
+        reader.close()
+        table = GameTable(table_id, game_logic.number_of_players, game_logic, EventLogWriter(path, game_logic, resume=True), self.metrics,
+                          self.turn_timeout, self.prompt_timeout, self.timeout_action, self.spectator_policy,
+                          reconnect_grace=self.reconnect_grace, bots=self.bots, scheduler=self.scheduler,
+                          spectator_hands=self.spectator_key is not None)
+        table.tokens = load_table_tokens(self.log_dir, table_id)
+        for player_id, token in table.tokens.items():
+            self.sessions[token] = (table, player_id)
+        self.tables[table_id] = table
+        print(f"table {table_id}: resuming at round {game_logic.round}")
+        return table
+
+    def open_table(self, table_id=None):
+        """Opens a new table, logging it if a log directory is set."""
+        if table_id is None:
+            table_id = self.next_table_id
+            self.next_table_id += 1
+        table = GameTable(table_id, self.num_players, metrics=self.metrics,
+                          turn_timeout=self.turn_timeout, prompt_timeout=self.prompt_timeout, timeout_action=self.timeout_action,
+                          spectator_policy=self.spectator_policy, reconnect_grace=self.reconnect_grace, bots=self.bots, scheduler=self.scheduler,
+                          spectator_hands=self.spectator_key is not None)
+        if self.log_dir is not None:
+            table.event_log = EventLogWriter(table_log_path(self.log_dir, table_id), table.game_logic)
+        self.tables[table_id] = table
+        self.metrics.set("tables", len(self.tables))
+        return table
+
+    def start_table(self, table):
+        """Starts the game of a full table in the background."""
+        print(f"table {table.table_id}: all players connected")
+        if self.log_dir is not None:
+            save_table_tokens(self.log_dir, table.table_id, table.tokens)
+        # before the task runs, so a seat reclaimed meanwhile cannot start the game twice
+        table.started = True
+        task = asyncio.create_task(table.start_game())
+        task.add_done_callback(lambda _: self.close_table(table))
+        return task
+
+    def seat_player(self, writer):
+        """Seats a player at the first waiting table with a free seat, opening one if needed.
+
+        The seat is settling until settle_player is called for it.
+        """
+        table = next((table for table in self.waiting_tables if not table.is_full()), None)
+        if table is None:
+            if self.max_tables is not None and len(self.tables) >= self.max_tables:
+                return None, None
+            table = self.open_table()
+            self.waiting_tables.append(table)
+        player_id = table.add_player(writer)
+        table.settling.add(player_id)
+        self.sessions[table.tokens[player_id]] = (table, player_id)
+        print(f"table {table.table_id}: there are {len(table.player_writers)} players connected")
+        return table, player_id
+
+    def settle_player(self, table, player_id):
+        """Marks a seat as a new player's, starting the table's game once every seat is."""
+        table.settling.discard(player_id)
+        if table in self.waiting_tables and table.is_ready():
+            self.waiting_tables.remove(table)
+            self.start_table(table)
+
+    def free_seat(self, table, player_id):
+        """Gives up the seat of a player who left, or turned out to be returning, before the game started."""
+        table.settling.discard(player_id)
+        table.player_writers.pop(player_id, None)
+        table.player_responses.pop(player_id, None)
+        table.outboxes.pop(player_id, None)
+        self.sessions.pop(table.tokens.pop(player_id), None)
+
+    async def host_table(self, table_id, sockets, tokens=None, reopen=False):
+        """Plays a game for a full set of already accepted player sockets and their session tokens.
+
+        The table is new, or with reopen, carries on the unfinished game of its log.
+        """
+        table = self.reopen_table(table_id) if reopen else self.open_table(table_id)
+        players = []
+        for sock, token in zip(sockets, tokens or [None] * len(sockets)):
+            reader, writer = await asyncio.open_connection(sock=sock)
+            player_id = table.add_player(writer, token)
+            self.sessions[table.tokens[player_id]] = (table, player_id)
+            players.append((reader, player_id))
+        game = self.start_table(table)
+        await asyncio.gather(game, *(table.handle_player(reader, player_id) for reader, player_id in players))
+
+    async def host_resumed_table(self, table_id):
+        """Reopens a table whose game was cut short and waits for its players to come back and finish it."""
+        table = self.reopen_table(table_id)
+        await table.ended.wait()
+
+    def close_table(self, table):
+        """Forgets a table whose game has ended."""
+        self.tables.pop(table.table_id, None)
+        for token in table.tokens.values():
+            self.sessions.pop(token, None)
+        self.metrics.inc("games_total")
+        self.metrics.set("tables", len(self.tables))
+        if self.log_dir is not None and table.game_logic.is_game_over():
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(table_tokens_path(self.log_dir, table.table_id))
+        # keep the registry from growing with every table ever hosted
+        self.metrics.remove(table=table.table_id)
+
+    async def handle_connection(self, reader, writer):
+        """Handles one player connection for its whole lifetime.
+
+        The player is seated right away; a join message with a session token
+        as the first frame gives the seat up again and resumes that session.
+        """
+        table, player_id = self.seat_player(writer)
+        decoder = protocol.FrameDecoder()
+        messages = await self.read_first_messages(reader, decoder)
+        if messages is None:
+            if table is not None:
+                self.free_seat(table, player_id)
+            writer.close()
+            return
+        if messages and messages[0]["type"] == "join":
+            token = messages.pop(0).get("token")
+            if token is not None and (table is None or table in self.waiting_tables):
+                if table is not None:
+                    self.free_seat(table, player_id)
+                await self.resume_connection(reader, writer, token, decoder, messages)
+                return
+        if table is None:
+            writer.write(protocol.encode_frame([protocol.make_message("error", "Server is full. Please try again later.")]))
+            await writer.drain()
+            writer.close()
+            return
+        self.settle_player(table, player_id)
+        await table.handle_player(reader, player_id, decoder, messages)
+        # a player who leaves before the game started frees their seat again
+        if table in self.waiting_tables and player_id in table.tokens:
+            self.free_seat(table, player_id)
+
+    async def read_first_messages(self, reader, decoder):
+        """Returns the messages of the first frame a client sends, and any read along with it.
+
+        A client that sends nothing within JOIN_TIMEOUT, or garbles its first
+        frame, gets none, and None means it left; decoder keeps whatever was
+        read past the messages.
+        """
+        try:
+            while True:
+                data = await asyncio.wait_for(reader.read(4096), JOIN_TIMEOUT)
+                if not data:
+                    return None
+                messages = decoder.feed(data)
+                if messages:
+                    return messages
+        except (asyncio.TimeoutError, protocol.ProtocolError):
+            return []
+        except ConnectionError:
+            return None
+
+    async def resume_socket(self, sock, token):
+        """Puts a returning player whose socket was already accepted back in their seat."""
+        reader, writer = await asyncio.open_connection(sock=sock)
+        await self.resume_connection(reader, writer, token)
+
+    async def resume_connection(self, reader, writer, token, decoder=None, messages=()):
+        """Puts a returning player back in their seat for the rest of the game.
+
+        decoder and messages carry on from whatever was read of the connection already.
+        """
+        table, player_id = self.sessions.get(token, (None, None))
+        if table is None or table.closed:
+            writer.write(protocol.encode_frame([protocol.make_message("error", "Unknown or expired session.")]))
+            writer.close()
+            return
+        if not table.started:
+            await self.reclaim_seat(reader, writer, table, player_id, decoder, messages)
+            return
+        table.resume_player(writer, player_id)
+        await table.handle_player(reader, player_id, decoder, messages)
+
+    async def reclaim_seat(self, reader, writer, table, player_id, decoder=None, messages=()):
+        """Seats a player back at a reopened table, carrying on its game once all of them are back."""
+        old_writer = table.player_writers.get(player_id)
+        if old_writer is not None:
+            old_writer.close()
+        table.add_player(writer, table.tokens[player_id], player_id)
+        print(f"table {table.table_id}: player {player_id} is back")
+        if table.is_full():
+            self.start_table(table)
+        await table.handle_player(reader, player_id, decoder, messages)
+        # the seat stays theirs if they leave again before the game carries on
+        if not table.started and player_id not in table.player_writers:
+            table.player_responses.pop(player_id, None)
+            table.outboxes.pop(player_id, None)
+
+    async def serve_spectators(self):
+        """Accepts spectators; their updates are written by a sender thread, off the event loop."""
+        loop = asyncio.get_running_loop()
+        self.sender = fanout.SocketSender()
+        listener = socket.create_server((self.host, self.spectator_port), backlog=1024)
+        listener.setblocking(False)
+        while True:
+            spectator_socket, _ = await loop.sock_accept(listener)
+            asyncio.create_task(self.seat_spectator(spectator_socket))
+
+    async def seat_spectator(self, spectator_socket):
+        """Adds a spectator to the table named by their first message, if it carries the spectator key where one is set."""
+        loop = asyncio.get_running_loop()
+        decoder = protocol.FrameDecoder()
+        messages = []
+        try:
+            while not messages:
+                data = await asyncio.wait_for(loop.sock_recv(spectator_socket, 4096), 10.0)
+                if not data:
+                    spectator_socket.close()
+                    return
+                messages = decoder.feed(data)
+        except (asyncio.TimeoutError, protocol.ProtocolError, ConnectionError):
+            spectator_socket.close()
+            return
+        table = self.tables.get(messages[0].get("table")) if messages[0]["type"] == "spectate" else None
+        error = "No such table." if table is None else None
+        if self.spectator_key is not None and not fanout.key_matches(messages[0].get("key"), self.spectator_key):
+            error = "Wrong spectator key."
+        if error is not None:
+            try:
+                await loop.sock_sendall(spectator_socket, protocol.encode_frame([protocol.make_message("error", error)]))
+            except ConnectionError:
+                pass
+            spectator_socket.close()
+            return
+        table.audience.add(fanout.SocketConnection(spectator_socket, self.sender))
+
+
+# Example usage
+if __name__ == "__main__":
+    num_players = h.get_number_of_players()
+    metrics = m.Metrics()
+    m.MetricsServer(metrics, port=9100).start()
+    server = AsyncGameServer("localhost", 12330, num_players, log_dir="logs", metrics=metrics, spectator_port=12331)
+    server.start()
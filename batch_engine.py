@@ -0,0 +1,184 @@
+import argparse
+import time
+import numpy as np
+import Hannabis as h
+
+# Cards are small integer codes: color_index * 5 + (number - 1).
+# Empty hand slots hold EMPTY.
+EMPTY = -1
+HAND_SIZE = 5
+NUM_INFOS = 10
+PASS = -1
+
+# Actions are integers: 0-4 play the card at that position, and
+# HAND_SIZE + (target_offset - 1) * NUM_INFOS + info_index gives a hint, where
+# target_offset counts seats after the current player and info_index is a
+# color index (0-4) or 5 + number - 1. PASS is only accepted from a player
+# with no cards and no information tokens.
+
+encode_card = h.encode_card
+decode_card = h.decode_card
+
+def encode_hint(target_offset, info):
+    """Returns the action code of a hint, info being a color or a number string."""
+    info_index = 5 + int(info) - 1 if info.isdigit() else h.COLORS.index(info)
+    return HAND_SIZE + (target_offset - 1) * NUM_INFOS + info_index
+
+def create_decks(batch_size, num_players, rng):
+    """Creates one shuffled deck per game with a single batched permutation."""
+    base = np.array([color * 5 + number - 1 for color in range(num_players) for number in h.NUMBERS], dtype=np.int8)
+    return rng.permuted(np.tile(base, (batch_size, 1)), axis=1)
+
+class BatchGame:
+    """Struct-of-arrays state for many games that advance in lock step.
+
+    Rules mirror GameLogic.is_play_valid, get_informed_cards and is_game_over.
+    """
+    def __init__(self, batch_size, num_players, seed=None, decks=None):
+        self.batch_size = batch_size
+        self.num_players = num_players
+        self.num_actions = HAND_SIZE + (num_players - 1) * NUM_INFOS
+        self.rng = np.random.default_rng(seed)
+        self.decks = create_decks(batch_size, num_players, self.rng) if decks is None else np.asarray(decks, dtype=np.int8)
+        dealt = num_players * HAND_SIZE
+        self.hands = self.decks[:, :dealt].reshape(batch_size, num_players, HAND_SIZE).copy()
+        self.deck_pointer = np.full(batch_size, dealt, dtype=np.int16)
+        self.info_tokens = np.full(batch_size, num_players + 3, dtype=np.int8)
+        self.fuse_tokens = np.full(batch_size, 3, dtype=np.int8)
+        self.fireworks = np.zeros((batch_size, num_players), dtype=np.int8)
+        self.score = np.zeros(batch_size, dtype=np.int16)
+        self.turns = np.zeros(batch_size, dtype=np.int32)
+        self.current_player = np.zeros(batch_size, dtype=np.int8)
+        self.done = np.zeros(batch_size, dtype=bool)
+        self.rows = np.arange(batch_size)
+
+    def current_hands(self):
+        """Returns the hand of the current player of every game."""
+        return self.hands[self.rows, self.current_player]
+
+    def is_play_valid(self, cards):
+        """Checks a card code per game against the rules of GameLogic.is_play_valid."""
+        colors = np.maximum(cards, 0) // 5
+        return self.fireworks[self.rows, colors] == cards % 5
+
+    def hint_matches(self, target_hands, info_index):
+        """Returns which cards of each target hand match the hinted color or number."""
+        info_index = info_index[:, None]
+        colors = np.where(info_index < 5, target_hands // 5, target_hands % 5 + 5)
+        return (target_hands != EMPTY) & (colors == info_index)
+
+    def legal_action_mask(self):
+        """Returns a (batch, num_actions) mask of the actions each current player may take."""
+        mask = np.zeros((self.batch_size, self.num_actions), dtype=bool)
+        mask[:, :HAND_SIZE] = self.current_hands() != EMPTY
+        can_hint = self.info_tokens > 0
+        for target_offset in range(1, self.num_players):
+            target = (self.current_player + target_offset) % self.num_players
+            target_hands = self.hands[self.rows, target]
+            start = HAND_SIZE + (target_offset - 1) * NUM_INFOS
+            present = np.zeros((self.batch_size, NUM_INFOS), dtype=bool)
+            occupied = target_hands != EMPTY
+            np.logical_or.at(present, (np.repeat(self.rows, HAND_SIZE), (target_hands // 5).ravel()), occupied.ravel())
+            np.logical_or.at(present, (np.repeat(self.rows, HAND_SIZE), (target_hands % 5 + 5).ravel()), occupied.ravel())
+            mask[:, start:start + NUM_INFOS] = present & can_hint[:, None]
+        mask[self.done] = False
+        return mask
+
+    def apply_actions(self, actions):
+        """Advances every unfinished game by one action.
+
+        Returns (valid, success): which actions were applied, and which of
+        them were successful card plays. Invalid actions leave their game
+        untouched and the same player to move.
+        """
+        actions = np.asarray(actions)
+        rows = self.rows
+        active = ~self.done
+        current = self.current_player
+        hands = self.current_hands()
+
+        # plays
+        play_index = np.clip(actions, 0, HAND_SIZE - 1)
+        cards = hands[rows, play_index]
+        played = active & (actions >= 0) & (actions < HAND_SIZE) & (cards != EMPTY)
+        colors = np.maximum(cards, 0) // 5
+        numbers = (cards % 5 + 1).astype(np.int8)
+        valid_card = self.is_play_valid(cards)
+        success = played & valid_card
+        failed = played & ~valid_card
+        self.score += success
+        self.info_tokens += success & (numbers == 5)
+        self.fuse_tokens -= failed
+        self.fireworks[rows[success], colors[success]] = numbers[success]
+
+        # draw into the played slot, or close the gap once the deck is empty
+        has_deck = self.deck_pointer < self.decks.shape[1]
+        draw = played & has_deck
+        drawn = rows[draw]
+        self.hands[drawn, current[drawn], play_index[drawn]] = self.decks[drawn, self.deck_pointer[drawn]]
+        self.deck_pointer += draw
+        shift = rows[played & ~has_deck]
+        if shift.size:
+            slots = np.arange(HAND_SIZE)[None, :]
+            source = slots + (slots >= play_index[shift, None])
+            shifted = np.take_along_axis(hands[shift], np.minimum(source, HAND_SIZE - 1), axis=1)
+            shifted[source >= HAND_SIZE] = EMPTY
+            self.hands[shift, current[shift]] = shifted
+
+        # hints
+        hint_code = actions - HAND_SIZE
+        target_offset = hint_code // NUM_INFOS + 1
+        info_index = hint_code % NUM_INFOS
+        target = (current + target_offset) % self.num_players
+        hinted = active & (actions >= HAND_SIZE) & (target_offset < self.num_players) & (self.info_tokens > 0)
+        hinted &= self.hint_matches(self.hands[rows, target], info_index).any(axis=1)
+        self.info_tokens -= hinted
+
+        # a player with nothing to do passes
+        passed = active & (actions == PASS) & ~(hands != EMPTY).any(axis=1) & (self.info_tokens <= 0)
+
+        valid = played | hinted | passed
+        self.current_player = np.where(valid, (current + 1) % self.num_players, current).astype(np.int8)
+        self.turns += played | hinted
+        self.done |= self.game_over_mask()
+        return valid, success
+
+    def game_over_mask(self):
+        """Checks every game against the rules of GameLogic.is_game_over."""
+        out_of_cards = (self.deck_pointer >= self.decks.shape[1]) & (self.hands == EMPTY).all(axis=(1, 2))
+        won = (self.fireworks == 5).sum(axis=1) == self.num_players
+        return won | (self.fuse_tokens <= 0) | out_of_cards
+
+    def random_actions(self):
+        """Picks a uniformly random legal action per game, or PASS if there is none."""
+        mask = self.legal_action_mask()
+        scores = np.where(mask, self.rng.random(mask.shape), -1.0)
+        return np.where(mask.any(axis=1), scores.argmax(axis=1), PASS)
+
+    def run(self, policy=None, max_steps=10000):
+        """Plays every game to the end with policy(batch_game) -> actions."""
+        policy = policy or BatchGame.random_actions
+        steps = 0
+        while not self.done.all() and steps < max_steps:
+            self.apply_actions(policy(self))
+            steps += 1
+        return self.score
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many random games at once with NumPy.")
+    parser.add_argument("--games", type=int, default=100000, help="number of games in the batch")
+    parser.add_argument("--players", type=int, default=3, help="number of players per game (2-5)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    game = BatchGame(args.games, args.players, args.seed)
+    scores = game.run()
+    elapsed = time.perf_counter() - started
+    print(f"{args.games} games of {args.players} players in {elapsed:.2f}s ({args.games / elapsed:.0f} games/sec)")
+    print(f"Mean score: {scores.mean():.2f}, mean turns: {game.turns.mean():.1f}")
+    for score, count in zip(*np.unique(scores, return_counts=True)):
+        print(f"  score {score:2d}: {count}")
+
+if __name__ == "__main__":
+    main()
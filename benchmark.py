@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from client import GameClient
+
+# Launch commands for the servers under test; {port} and {players} are filled in.
+SERVER_COMMANDS = {
+    "async": "import async_server; async_server.AsyncGameServer('127.0.0.1', {port}, {players}).start()",
+    "threaded": "import game_server; game_server.GameServer('127.0.0.1', {port}, {players}).start()",
+    "supervisor": "import supervisor; supervisor.Supervisor('127.0.0.1', {port}, {players}).start()",
+}
+
+def percentiles(samples):
+    """Returns p50/p95/p99 of samples in milliseconds."""
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+def process_usage(pid):
+    """Returns (cpu_seconds, rss_kb) of a process and its live children from /proc."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/status") as f:
+        # a server that has already exited has no resident set left
+        rss_kb = next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        children = [int(child) for child in f.read().split()]
+    for child in children:
+        try:
+            child_cpu, child_rss = process_usage(child)
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        cpu_seconds += child_cpu
+        rss_kb += child_rss
+    return cpu_seconds, rss_kb
+
+
+class BenchmarkBot(GameClient):
+    """Scripted client that answers every prompt step by step, like player.py, and records timings."""
+    def __init__(self, rng):
+        super().__init__()
+        self.rng = rng
+        self.hint_target = None
+        self.response_latencies = []
+        self.turn_latencies = []
+        self.messages = 0
+        self.bytes = 0
+        self.turns = 0
+        self.sent_at = None
+        self.last_turn_at = None
+        self.received_at = None
+
+    async def decide(self, view):
+        return "2" if view.info_tokens and self.rng.random() < 0.3 else "1"
+
+    async def answer(self, prompt, view):
+        """Picks a valid answer to a follow-up prompt."""
+        if prompt.startswith("Which card"):
+            own_hand = view.hands.get(view.viewer) or [None]
+            return self.rng.choice("abcde"[:len(own_hand)])
+        if prompt.startswith("Enter the target"):
+            options = prompt.split("options: ")[1].split(")")[0].split(", ")
+            self.hint_target = int(self.rng.choice(options))
+            return str(self.hint_target)
+        if prompt.startswith("Enter the information"):
+            hand = view.hands.get(self.hint_target) or ["Red1"]
+            card = self.rng.choice(hand)
+            return card[-1] if self.rng.random() < 0.5 else card[:-1]
+        return "1"
+
+    async def run(self, host, port):
+        """Connects and plays one game until the server closes the connection."""
+        self.last_turn_at = None
+        await super().run(host, port)
+
+    def feed(self, data):
+        self.received_at = time.perf_counter()
+        if self.sent_at is not None:
+            self.response_latencies.append(self.received_at - self.sent_at)
+            self.sent_at = None
+        self.bytes += len(data)
+        super().feed(data)
+
+    def handle(self, message):
+        self.messages += 1
+        super().handle(message)
+
+    def on_update(self, changes):
+        if any(change["op"] == "turn" for change in changes):
+            self.turns += 1
+            if self.last_turn_at is not None:
+                self.turn_latencies.append(self.received_at - self.last_turn_at)
+            self.last_turn_at = self.received_at
+
+    def send(self, text, prompt_id=None):
+        super().send(text, prompt_id)
+        self.sent_at = time.perf_counter()
+
+
+async def run_bots(host, ports, num_players, tables, games, seed):
+    """Fills every table with bots and plays `games` games per seat."""
+    rng = random.Random(seed)
+    bots = [BenchmarkBot(random.Random(rng.random())) for _ in range(tables * num_players)]
+    # one port per table for the threaded server, one shared port otherwise
+    targets = [ports[i // num_players % len(ports)] for i in range(len(bots))]
+
+    async def play(bot, port):
+        for _ in range(games):
+            await bot.run(host, port)
+
+    await asyncio.gather(*(play(bot, port) for bot, port in zip(bots, targets)))
+    return bots
+
+def start_servers(kind, num_players, tables, base_port):
+    """Starts the server processes for a stage and returns them with their ports."""
+    count = tables if kind == "threaded" else 1
+    here = os.path.dirname(os.path.abspath(__file__))
+    processes, ports = [], []
+    for i in range(count):
+        port = base_port + i
+        code = SERVER_COMMANDS[kind].format(port=port, players=num_players)
+        processes.append(subprocess.Popen([sys.executable, "-c", code], cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        ports.append(port)
+    time.sleep(0.5 + 0.01 * count)
+    if any(process.poll() is not None for process in processes):
+        for process in processes:
+            process.kill()
+        raise RuntimeError(f"A {kind} server exited on start; are ports {ports[0]}-{ports[-1]} free?")
+    return processes, ports
+
+def run_stage(kind, num_players, tables, games, base_port, seed):
+    """Plays `games` games on each of `tables` tables and returns the stage report."""
+    processes, ports = start_servers(kind, num_players, tables, base_port)
+    try:
+        usage_before = [process_usage(p.pid) for p in processes]
+        started = time.perf_counter()
+        bots = asyncio.run(run_bots("127.0.0.1", ports, num_players, tables, games, seed))
+        duration = time.perf_counter() - started
+        usage_after = [process_usage(p.pid) for p in processes]
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
+    # every player sees every turn, so count turns once per table
+    turns = sum(bot.turns for bot in bots) / num_players
+    cpu_seconds = sum(after[0] - before[0] for before, after in zip(usage_before, usage_after))
+    rss_kb = sum(after[1] for after in usage_after)
+    response_latencies = [t for bot in bots for t in bot.response_latencies]
+    return {
+        "tables": tables,
+        "players": num_players,
+        "games": tables * games,
+        "seconds": duration,
+        "turns": turns,
+        "turns_per_sec": turns / duration if duration else 0.0,
+        "turn_latency_ms": percentiles([t for bot in bots for t in bot.turn_latencies]),
+        "response_latency_ms": percentiles(response_latencies),
+        "server_cpu_ms_per_turn": cpu_seconds * 1000 / turns if turns else None,
+        "client_wait_ms_per_turn": sum(response_latencies) * 1000 / turns if turns else None,
+        "messages_per_turn": sum(bot.messages for bot in bots) / turns if turns else None,
+        "bytes_per_turn": sum(bot.bytes for bot in bots) / turns if turns else None,
+        "cpu_seconds_per_table": cpu_seconds / tables,
+        "rss_kb_per_table": rss_kb / tables,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test a game server with scripted bots and report JSON.")
+    parser.add_argument("--server", choices=sorted(SERVER_COMMANDS), default="async", help="server implementation to test")
+    parser.add_argument("--players", type=int, default=3, help="players per table")
+    parser.add_argument("--tables", type=int, nargs="+", default=[1, 10, 50, 100], help="table counts to run, one stage each")
+    parser.add_argument("--games", type=int, default=5, help="games per table (the threaded server hosts one game per process)")
+    parser.add_argument("--latency-budget", type=float, default=50.0, help="p99 response latency (ms) a stage must stay under to count as sustainable")
+    parser.add_argument("--port", type=int, default=13300, help="first port to listen on")
+    parser.add_argument("--seed", type=int, default=0, help="bot random seed")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    games = 1 if args.server == "threaded" else args.games
+    stages = []
+    for i, tables in enumerate(args.tables):
+        stage = run_stage(args.server, args.players, tables, games, args.port + i * max(args.tables), args.seed)
+        stages.append(stage)
+        p99 = stage["response_latency_ms"]["p99"]
+        # a stage that got no responses has no latency to show
+        p99_text = "n/a" if p99 is None else f"{p99:.2f} ms"
+        print(f"{tables} tables: {stage['turns_per_sec']:.0f} turns/sec, p99 response {p99_text}", file=sys.stderr)
+    sustainable = [s["tables"] for s in stages if s["response_latency_ms"]["p99"] is not None and s["response_latency_ms"]["p99"] <= args.latency_budget]
+    report = {
+        "server": args.server,
+        "latency_budget_ms": args.latency_budget,
+        "max_tables": max(sustainable, default=0),
+        "stages": stages,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
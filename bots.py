@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import time
+import numpy as np
+import Hannabis as h
+import metrics as m
+from async_server import GameTable
+from batch_engine import EMPTY, HAND_SIZE, NUM_INFOS, PASS
+
+# A decision request is one row of integers describing what a bot seat can
+# see: the player count, the information tokens, the height of every
+# firework, the knowledge masks of its own cards and, for every other seat in
+# turn order, their cards and knowledge masks. Firework heights of colors not
+# in the game are 5, so none of their cards is ever playable. Decisions are
+# action codes as in batch_engine: 0-4 play a card, higher codes are hints.
+MAX_OTHERS = 4
+PLAYERS = 0
+INFO_TOKENS = 1
+FIREWORKS = 2
+OWN = FIREWORKS + len(h.COLORS)
+HANDS = OWN + HAND_SIZE
+KNOWLEDGE = HANDS + MAX_OTHERS * HAND_SIZE
+ROW_SIZE = KNOWLEDGE + MAX_OTHERS * HAND_SIZE
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+Request = collections.namedtuple('Request', 'row player_id num_players future submitted')
+
+def encode_request(game, player_id):
+    """Returns the decision row of player_id's view of game."""
+    num_players = game.number_of_players
+    row = [0] * ROW_SIZE
+    row[PLAYERS] = num_players
+    row[INFO_TOKENS] = game.shared_tokens['info_tokens']
+    for i, color in enumerate(h.COLORS):
+        row[FIREWORKS + i] = game.fireworks.get(color, 5)
+    row[OWN:OWN + len(game.knowledge[player_id])] = game.knowledge[player_id]
+    row[HANDS:KNOWLEDGE] = [EMPTY] * (MAX_OTHERS * HAND_SIZE)
+    for offset in range(1, num_players):
+        target_player_id = (player_id - 1 + offset) % num_players + 1
+        start = (offset - 1) * HAND_SIZE
+        hand = game.shared_hands[target_player_id]
+        row[HANDS + start:HANDS + start + len(hand)] = [card.code for card in hand]
+        masks = game.knowledge[target_player_id]
+        row[KNOWLEDGE + start:KNOWLEDGE + start + len(masks)] = masks
+    return row
+
+def decode_action(code, player_id, num_players):
+    """Turns an action code into the engine action of player_id, or None for PASS."""
+    if code == PASS:
+        return None
+    if code < HAND_SIZE:
+        return ('play', int(code))
+    seats_after, info_index = divmod(int(code) - HAND_SIZE, NUM_INFOS)
+    target_player_id = (player_id + seats_after) % num_players + 1
+    info = h.COLORS[info_index] if info_index < 5 else str(info_index - 4)
+    return ('hint', target_player_id, info)
+
+def popcount(masks):
+    """Counts the set bits of every 25-bit mask."""
+    return sum(POPCOUNT[(masks >> shift) & 0xFF] for shift in (0, 8, 16, 24))
+
+def choose_actions(rows):
+    """Decides a whole batch of requests at once and returns one action code per row.
+
+    A bot plays a card it knows is playable, otherwise hints a playable card
+    its owner does not know about yet, otherwise plays the card most likely to
+    be playable from what it knows. A bot with no cards hints anything, and
+    passes if it cannot.
+    """
+    rows = np.asarray(rows, dtype=np.int64).reshape(-1, ROW_SIZE)
+    fireworks = rows[:, FIREWORKS:OWN]
+    colors = np.arange(len(h.COLORS))
+    playable = np.where(fireworks < 5, np.left_shift(1, np.minimum(colors * 5 + fireworks, 62)), 0).sum(axis=1)
+    own = rows[:, OWN:HANDS]
+    hands = rows[:, HANDS:KNOWLEDGE]
+    knowledge = rows[:, KNOWLEDGE:]
+    has_token = rows[:, INFO_TOKENS] > 0
+
+    known = (own != 0) & (own & ~playable[:, None] == 0)
+    # cards are checked seat by seat in turn order, so the earliest one wins
+    occupied = hands != EMPTY
+    hintable = occupied & ((playable[:, None] >> np.maximum(hands, 0)) & 1 == 1) & (knowledge & ~playable[:, None] != 0)
+    chances = np.where(own != 0, popcount(own & playable[:, None]) / np.maximum(popcount(own), 1), -1.0)
+
+    def number_hint(slots):
+        cards = np.take_along_axis(hands, slots[:, None], axis=1)[:, 0]
+        return HAND_SIZE + slots // HAND_SIZE * NUM_INFOS + 5 + cards % 5
+
+    return np.select(
+        [known.any(axis=1), has_token & hintable.any(axis=1), (own != 0).any(axis=1), has_token & occupied.any(axis=1)],
+        [known.argmax(axis=1), number_hint(hintable.argmax(axis=1)), chances.argmax(axis=1), number_hint(occupied.argmax(axis=1))],
+        PASS)
+
+
+class DecisionScheduler:
+    """Decides the moves of bot seats from every table in batches on one thread.
+
+    Tables submit a request when a bot's turn comes up and wait for its
+    future. The thread takes requests off the queue in batches of up to
+    batch_size, waiting at most max_wait_ms after the oldest one for the batch
+    to fill, and decides each batch with one vectorized call.
+    """
+    def __init__(self, batch_size=256, max_wait_ms=2.0, policy=choose_actions, metrics=None):
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.policy = policy
+        self.metrics = metrics or m.DISABLED
+        self.condition = threading.Condition()
+        self.requests = collections.deque()
+        self.closed = False
+        self.batches = 0
+        self.decisions = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, game, player_id):
+        """Queues a decision for player_id, who is to move in game; returns a future of the engine action.
+
+        The game must not change until the future is done.
+        """
+        future = concurrent.futures.Future()
+        request = Request(encode_request(game, player_id), player_id, game.number_of_players, future, time.perf_counter())
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The decision scheduler is closed.")
+            self.requests.append(request)
+            depth = len(self.requests)
+            # wake the thread for a first request, and again once a batch is full
+            if depth == 1 or depth == self.batch_size:
+                self.condition.notify()
+        self.metrics.set("bot_queue_depth", depth)
+        return future
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.requests and not self.closed:
+                    self.condition.wait()
+                if not self.requests:
+                    return
+                deadline = self.requests[0].submitted + self.max_wait
+                while len(self.requests) < self.batch_size and not self.closed:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = [self.requests.popleft() for _ in range(min(self.batch_size, len(self.requests)))]
+                depth = len(self.requests)
+            self.metrics.set("bot_queue_depth", depth)
+            self.decide(batch)
+
+    def decide(self, batch):
+        """Decides one batch and completes its futures."""
+        try:
+            with self.metrics.timer("bot_batch_seconds"):
+                codes = self.policy([request.row for request in batch])
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        self.batches += 1
+        self.decisions += len(batch)
+        self.metrics.inc("bot_batches_total")
+        self.metrics.inc("bot_decisions_total", len(batch))
+        self.metrics.observe("bot_batch_fill", len(batch) / self.batch_size)
+        now = time.perf_counter()
+        for request, code in zip(batch, codes):
+            self.metrics.observe("bot_decision_seconds", now - request.submitted)
+            request.future.set_result(decode_action(code, request.player_id, request.num_players))
+
+    def close(self):
+        """Decides what is still queued, then stops the thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+
+async def play_bot_tables(num_tables, num_players, scheduler):
+    """Plays one game at each of num_tables tables of bots only, all in this event loop."""
+    tables = [GameTable(table_id, num_players, bots=num_players, scheduler=scheduler) for table_id in range(1, num_tables + 1)]
+    await asyncio.gather(*(table.start_game() for table in tables))
+    return tables
+
+def main():
+    parser = argparse.ArgumentParser(description="Play tables of server-hosted bots and report decisions per second.")
+    parser.add_argument("--tables", type=int, default=500, help="tables playing at once")
+    parser.add_argument("--players", type=int, default=3, help="bots per table (2-5)")
+    parser.add_argument("--batch-size", type=int, default=256, help="largest batch of decisions")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0, help="longest wait for a batch to fill")
+    args = parser.parse_args()
+
+    scheduler = DecisionScheduler(args.batch_size, args.max_wait_ms)
+    started = time.perf_counter()
+    tables = asyncio.run(play_bot_tables(args.tables, args.players, scheduler))
+    elapsed = time.perf_counter() - started
+    scheduler.close()
+    scores = [table.game_logic.score for table in tables]
+    print(f"{scheduler.decisions} decisions in {elapsed:.2f}s: {scheduler.decisions / elapsed:.0f} decisions/s")
+    print(f"{scheduler.batches} batches, {scheduler.decisions / max(scheduler.batches, 1):.1f} decisions per batch")
+    print(f"mean score {sum(scores) / len(scores):.2f}")
+
+if __name__ == "__main__":
+    main()
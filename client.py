@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import random
+import threading
+import time
+import protocol
+from game_state import GameView
+
+TURN_PROMPT = "Choose action"
+# How long a client whose connection dropped keeps trying to take its seat back
+RECONNECT_WINDOW = 30.0
+RECONNECT_DELAY = 0.5
+
+def format_action(action):
+    """Turns an engine action into the whole-turn command the servers accept; strings are sent as they are."""
+    if isinstance(action, str):
+        return action
+    if action[0] == 'play':
+        return f"play {chr(ord('a') + action[1])}"
+    return f"give {action[1]} {action[2]}"
+
+
+class GameClient:
+    """Asyncio player connection that keeps a GameView current and asks decide() for every move.
+
+    Reading never stops while a decision is pending, so updates keep
+    arriving however long decide() takes.
+    """
+    def __init__(self):
+        self.view = GameView()
+        self.decoder = None
+        self.writer = None
+        self.pending = None
+        self.result = None  # text of the last result message
+        self.token = None  # session token, sent when reconnecting
+        self.ended = False  # set by the server's last message of the game
+
+    async def decide(self, view):
+        """Returns the move for the turn prompt: an action such as ('play', 0) or ('hint', 2, 'Red'), or a reply string."""
+        raise NotImplementedError
+
+    async def answer(self, prompt, view):
+        """Returns the reply to a follow-up prompt, only asked when decide() answered '1' or '2'."""
+        raise NotImplementedError(f"Unexpected prompt: {prompt}")
+
+    def on_update(self, changes):
+        """Called after a snapshot or delta was applied to the view."""
+
+    def on_message(self, message):
+        """Called for every text, prompt, result and error message."""
+
+    async def run(self, host, port, spectate=None, token=None, spectator_key=None):
+        """Connects and plays until the server closes the connection, or watches table `spectate` on a spectator port.
+
+        Pass the server's spectator_key to watch a server that only lets in spectators holding it.
+
+        If the connection drops, the client takes its seat back with its session
+        token, or with `token` from the start.
+        """
+        self.view = GameView()
+        self.token = token
+        self.ended = False
+        reconnect_deadline = None
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_connection(host, port)
+            except OSError:
+                if reconnect_deadline is None or time.monotonic() >= reconnect_deadline:
+                    raise
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            self.decoder = protocol.FrameDecoder()
+            if spectate is not None:
+                self.writer.write(protocol.encode_frame([protocol.make_message("spectate", table=spectate, key=spectator_key)]))
+            else:
+                self.writer.write(protocol.encode_frame([protocol.make_message("join", token=self.token)]))
+            if not await self.read(reader) or self.ended or spectate is not None or self.token is None:
+                return
+            if reconnect_deadline is None:
+                reconnect_deadline = time.monotonic() + RECONNECT_WINDOW
+
+    async def read(self, reader):
+        """Handles what the server sends until the connection closes; returns True if it dropped instead."""
+        try:
+            while True:
+                try:
+                    data = await reader.read(65536)
+                except ConnectionError:
+                    return True
+                if not data:
+                    return False
+                self.feed(data)
+        finally:
+            if self.pending is not None:
+                self.pending.cancel()
+            self.writer.close()
+
+    def feed(self, data):
+        """Handles a chunk of bytes read from the server."""
+        for message in self.decoder.feed(data):
+            self.handle(message)
+
+    def handle(self, message):
+        if message["type"] in ("snapshot", "delta"):
+            self.on_update(self.view.apply(message))
+            return
+        if message["type"] == "session":
+            self.token = message["token"]
+            return
+        if message["type"] == "result":
+            self.result = message.get("text")
+        self.ended = self.ended or message.get("end", False)
+        self.on_message(message)
+        if message["type"] == "prompt":
+            if self.pending is not None:
+                self.pending.cancel()
+            self.pending = asyncio.create_task(self.reply(message["text"], message.get("id")))
+
+    async def reply(self, prompt, prompt_id=None):
+        """Asks the hooks for the reply to a prompt and sends it, naming the prompt it answers."""
+        if prompt.startswith(TURN_PROMPT):
+            response = format_action(await self.decide(self.view))
+        else:
+            response = await self.answer(prompt, self.view)
+        self.send(response, prompt_id)
+
+    def send(self, text, prompt_id=None):
+        self.writer.write(protocol.encode_frame([protocol.make_message("response", text, prompt=prompt_id)]))
+
+
+class TerminalClient(GameClient):
+    """The interactive player: prints what happens and reads every reply from the keyboard."""
+    def __init__(self):
+        super().__init__()
+        self.lines = None
+
+    async def decide(self, view):
+        return await self.read_line()
+
+    async def answer(self, prompt, view):
+        return await self.read_line()
+
+    async def read_line(self):
+        """Returns the next line typed, in order, even if the prompt it was typed for was replaced."""
+        if self.lines is None:
+            self.start_reading()
+        print("-> ", end="", flush=True)
+        return await self.lines.get()
+
+    def start_reading(self):
+        # one daemon thread reads stdin for the whole session, so updates keep
+        # printing while the player types and no line goes to a stale prompt
+        loop = asyncio.get_running_loop()
+        self.lines = asyncio.Queue()
+
+        def read():
+            while True:
+                try:
+                    text = input()
+                    loop.call_soon_threadsafe(self.lines.put_nowait, text)
+                except (EOFError, RuntimeError):
+                    # stdin closed, or the client has stopped
+                    return
+
+        threading.Thread(target=read, daemon=True).start()
+
+    def on_update(self, changes):
+        if any(change["op"] == "turn" for change in changes):
+            print(self.view.render())
+
+    def on_message(self, message):
+        print(protocol.render_message(message))
+
+
+class RandomBot(GameClient):
+    """Bot that sends a random legal move as a whole turn."""
+    def __init__(self, rng=random):
+        super().__init__()
+        self.rng = rng
+
+    async def decide(self, view):
+        return self.rng.choice(view.legal_actions())
+
+
+async def run_bots(host, port, count, bot_class=RandomBot, seed=0):
+    """Plays one game with count bots sharing this process and returns them."""
+    rng = random.Random(seed)
+    bots = [bot_class(random.Random(rng.random())) for _ in range(count)]
+    await asyncio.gather(*(bot.run(host, port) for bot in bots))
+    return bots
+
+def main():
+    parser = argparse.ArgumentParser(description="Connect random bots to a game server.")
+    parser.add_argument("--host", default="localhost", help="server host")
+    parser.add_argument("--port", type=int, default=12330, help="server port")
+    parser.add_argument("--bots", type=int, default=3, help="bots to connect")
+    parser.add_argument("--seed", type=int, default=0, help="bot random seed")
+    parser.add_argument("--spectate", type=int, metavar="TABLE", help="watch a table in the terminal instead; --port is then the spectator port")
+    parser.add_argument("--spectator-key", help="key of a server that only lets in spectators holding it")
+    args = parser.parse_args()
+
+    if args.spectate is not None:
+        asyncio.run(TerminalClient().run(args.host, args.port, spectate=args.spectate, spectator_key=args.spectator_key))
+        return
+
+    started = time.perf_counter()
+    bots = asyncio.run(run_bots(args.host, args.port, args.bots, seed=args.seed))
+    print(f"{args.bots} bots played in {time.perf_counter() - started:.2f}s")
+    print(f"Last result seen by the first bot: {bots[0].result}")
+
+if __name__ == "__main__":
+    main()
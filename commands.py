@@ -0,0 +1,31 @@
+class TurnTimeout(Exception):
+    """Raised when a player does not answer before their deadline."""
+
+def parse_turn_command(text, game_logic, player_id):
+    """Parses a whole turn typed as one message, such as "play a" or "give 3 Red".
+
+    Returns the engine action, or None if text is not a whole-turn command.
+    Raises ValueError if it looks like one but cannot be understood.
+    """
+    words = text.split()
+    if not words or words[0].lower() not in ("play", "give", "hint"):
+        return None
+    if words[0].lower() == "play":
+        if len(words) == 2 and len(words[1]) == 1 and words[1].lower() in "abcde":
+            return ('play', ord(words[1].lower()) - ord('a'))
+        raise ValueError(f"Could not understand '{text}'. Try 'play a'.")
+    if len(words) == 3 and words[1].isdigit():
+        info = words[2]
+        if info.isdigit() and 1 <= int(info) <= 5:
+            return ('hint', int(words[1]), info)
+        if info.capitalize() in game_logic.get_valid_colors():
+            return ('hint', int(words[1]), info.capitalize())
+    raise ValueError(f"Could not understand '{text}'. Try 'give 2 Red' or 'give 2 3'.")
+
+def default_timeout_action(game_logic, player_id):
+    """Returns the move made for a player who ran out of time: a hint if one is possible, otherwise the first legal move."""
+    actions = game_logic.legal_actions(player_id)
+    hints = [action for action in actions if action[0] == 'hint']
+    if hints:
+        return hints[0]
+    return actions[0] if actions else None
@@ -0,0 +1,217 @@
+import argparse
+import concurrent.futures
+import glob
+import mmap
+import os
+import struct
+import time
+import Hannabis as h
+
+# A log holds one game. It starts with a fixed header carrying the deck order
+# before dealing, followed by fixed-size event records:
+#
+#   kind, player, position/target, card/info code, value, extra
+#
+# - TURN:   player to move, round in extra
+# - PLAY:   player, position, card code, success in value
+# - DRAW:   player, position, card code
+# - HINT:   player, target, info code, positions bitmask in value
+# - TOKENS: info tokens in value, fuse tokens in extra
+# - END:    the game is over
+MAGIC = b"HLOG"
+VERSION = 1
+HEADER = struct.Struct("<4sBBB57s")
+RECORD = struct.Struct("<BBBBhH")
+TURN, PLAY, DRAW, HINT, TOKENS, END = range(1, 7)
+INFOS = h.COLORS + ['1', '2', '3', '4', '5']
+# Syncs due to fsync_interval run on this thread, so a server's event loop never waits for the disk
+SYNCER = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-log-sync")
+
+def encode_info(info):
+    """Returns the code of a hint: a color index or 5 + number - 1."""
+    return INFOS.index(info)
+
+def encode_positions(positions):
+    """Packs card letters into a bitmask."""
+    return sum(1 << (ord(letter) - ord('a')) for letter in positions)
+
+class EventLogWriter:
+    """Appends a game's events to its log, writing in batches and syncing at most every fsync_interval seconds.
+
+    A new writer starts the log over; pass resume=True to continue the log of
+    a game resumed from it. Periodic syncs run in the background on SYNCER;
+    only the syncs asked for, of the header and the end of the game, block.
+    """
+    def __init__(self, path, game_logic, buffer_size=4096, fsync_interval=1.0, resume=False):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.fsync_interval = fsync_interval
+        self.buffer = bytearray()
+        self.last_sync = time.monotonic()
+        self.pending_sync = None
+        exists = resume and os.path.getsize(path) >= HEADER.size
+        if exists:
+            # drop a record torn by a crash so new records stay aligned
+            size = os.path.getsize(path)
+            os.truncate(path, HEADER.size + (size - HEADER.size) // RECORD.size * RECORD.size)
+        self.file = open(path, "wb" if not exists else "ab")
+        if not exists:
+            deck = bytes(h.encode_card(card) for card in game_logic.initial_deck)
+            self.buffer += HEADER.pack(MAGIC, VERSION, game_logic.number_of_players, len(deck), deck)
+            # a log is only resumable once its whole header is on disk
+            self.flush(sync=True)
+
+    def append_turn(self, player_id, round):
+        """Records that player_id is to move in the given round."""
+        self.buffer += RECORD.pack(TURN, player_id, 0, 0, 0, round)
+
+    def append_events(self, events):
+        """Records the events returned by a GameLogic action."""
+        for event in events:
+            if event[0] == 'play':
+                _, player_id, card_index, card, success = event
+                self.buffer += RECORD.pack(PLAY, player_id, card_index, h.encode_card(card), success, 0)
+            elif event[0] == 'draw':
+                _, player_id, card_index, card = event
+                self.buffer += RECORD.pack(DRAW, player_id, card_index, h.encode_card(card), 0, 0)
+            elif event[0] == 'hint':
+                _, player_id, target_player_id, info, positions = event
+                self.buffer += RECORD.pack(HINT, player_id, target_player_id, encode_info(info), encode_positions(positions), 0)
+            elif event[0] == 'tokens':
+                self.buffer += RECORD.pack(TOKENS, 0, 0, 0, event[1], event[2])
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def append_end(self):
+        """Records that the game is over and syncs the log."""
+        self.buffer += RECORD.pack(END, 0, 0, 0, 0, 0)
+        self.flush(sync=True)
+
+    def flush(self, sync=False):
+        """Writes buffered records, syncing to disk when asked or when fsync_interval has passed."""
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.buffer.clear()
+        self.file.flush()
+        now = time.monotonic()
+        if sync:
+            os.fsync(self.file.fileno())
+            self.last_sync = now
+        elif now - self.last_sync >= self.fsync_interval and (self.pending_sync is None or self.pending_sync.done()):
+            self.pending_sync = SYNCER.submit(os.fsync, self.file.fileno())
+            self.last_sync = now
+
+    def close(self):
+        self.flush(sync=True)
+        # the file must stay open until its background sync is done
+        if self.pending_sync is not None:
+            concurrent.futures.wait([self.pending_sync])
+        self.file.close()
+
+
+class EventLogReader:
+    """Memory-maps a game log for scanning, seeking and replay."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise ValueError(f"{path} is too short to be a game log.")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.number_of_players, deck_len, deck = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a game log.")
+        self.deck = [h.decode_card(code) for code in deck[:deck_len]]
+        # ignore a record torn by a crash mid-write
+        self.end = HEADER.size + (len(self.map) - HEADER.size) // RECORD.size * RECORD.size
+        self.turn_offsets = None
+
+    def records(self, start=None):
+        """Iterates over the raw record tuples from the given byte offset."""
+        start = HEADER.size if start is None else start
+        return RECORD.iter_unpack(self.map[start:self.end])
+
+    def is_finished(self):
+        """Checks if the log ends with an END record."""
+        return self.end > HEADER.size and self.map[self.end - RECORD.size] == END
+
+    def turn_offset(self, turn):
+        """Returns the byte offset of the TURN record of the given turn (0-based)."""
+        if self.turn_offsets is None:
+            kinds = self.map[HEADER.size:self.end:RECORD.size]
+            self.turn_offsets = [HEADER.size + i * RECORD.size for i, kind in enumerate(kinds) if kind == TURN]
+        return self.turn_offsets[turn]
+
+    def replay(self, to_turn=None):
+        """Rebuilds the GameLogic as it was at the start of to_turn, or after the last record.
+
+        After the last record, the player whose turn was logged last is left
+        to move unless that turn's action was logged too.
+        """
+        game = h.GameLogic(self.number_of_players, deck=self.deck)
+        end = self.end
+        if to_turn is not None:
+            try:
+                end = self.turn_offset(to_turn)
+            except IndexError:
+                pass
+        acted = False
+        for kind, player_id, a, b, value, extra in RECORD.iter_unpack(self.map[HEADER.size:end]):
+            if kind == TURN:
+                game.current_player = player_id
+                game.round = extra
+                acted = False
+            elif kind == PLAY:
+                game.apply_play(player_id, a)
+                acted = True
+            elif kind == HINT:
+                game.apply_hint(player_id, a, INFOS[b])
+                acted = True
+        if end < self.end:
+            _, game.current_player, _, _, _, game.round = RECORD.unpack_from(self.map, end)
+        elif acted:
+            game.advance_turn()
+        return game
+
+    def close(self):
+        self.map.close()
+
+
+def unfinished_logs(log_dir, pattern="*.hlog"):
+    """Returns the paths of logs in log_dir matching pattern whose game is still running.
+
+    A log torn before its header was written holds no game and is skipped.
+    """
+    paths = []
+    for path in sorted(glob.glob(os.path.join(log_dir, pattern))):
+        try:
+            reader = EventLogReader(path)
+        except ValueError as e:
+            print(f"{e} Skipped.")
+            continue
+        if not reader.is_finished():
+            paths.append(path)
+        reader.close()
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan or replay game logs.")
+    parser.add_argument("paths", nargs="+", help="log files to read")
+    parser.add_argument("--replay", action="store_true", help="rebuild every game instead of only scanning records")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    events = 0
+    for path in args.paths:
+        reader = EventLogReader(path)
+        if args.replay:
+            game = reader.replay()
+            print(f"{path}: round {game.round}, score {game.score}, {game.get_game_over_reason() or 'in progress'}")
+        events += (reader.end - HEADER.size) // RECORD.size
+        for _ in reader.records():
+            pass
+        reader.close()
+    elapsed = time.perf_counter() - started
+    print(f"{events} events in {len(args.paths)} logs in {elapsed:.2f}s ({events / elapsed if elapsed else 0:.0f} events/sec)")
+
+if __name__ == "__main__":
+    main()
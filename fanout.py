@@ -0,0 +1,269 @@
+import collections
+import secrets
+import selectors
+import socket
+import threading
+import time
+import metrics as m
+import protocol
+from game_state import NO_HANDS
+
+# What to do with a spectator whose outbound buffer is full
+SNAPSHOT = "snapshot"      # skip updates, then send a fresh snapshot once it has caught up
+DISCONNECT = "disconnect"  # close the connection
+
+
+class Spectator:
+    """One spectator connection and whether it needs a snapshot before its next update."""
+    __slots__ = ('connection', 'stale')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.stale = True
+
+
+class Audience:
+    """The spectators of one table.
+
+    Public updates are encoded once per flush and handed to the sender
+    thread, which queues the same bytes to every spectator. The table's cost
+    does not depend on how many spectators there are or how fast they read.
+    Spectators see the table as viewer, game_state.NO_HANDS or ALL_HANDS.
+    """
+    def __init__(self, state_model, max_buffer=256 * 1024, policy=SNAPSHOT, metrics=None, table=None, viewer=NO_HANDS):
+        self.state_model = state_model
+        self.viewer = viewer
+        self.labels = {} if table is None else {"table": table}
+        self.max_buffer = max_buffer
+        self.policy = policy
+        self.metrics = metrics or m.DISABLED
+        self.lock = threading.Lock()
+        self.spectators = []
+        self.sender = None
+        self.pending = []
+        self.delivered = threading.Event()
+        self.delivered.set()
+        self.needs_snapshot = False
+        self.snapshot = (None, None)
+
+    def __len__(self):
+        return len(self.spectators)
+
+    def add(self, connection):
+        """Adds a spectator, who gets a snapshot with the next update."""
+        with self.lock:
+            self.sender = connection.sender
+            self.spectators.append(Spectator(connection))
+            self.needs_snapshot = True
+            self.metrics.set("spectators", len(self.spectators), **self.labels)
+
+    def publish(self, messages):
+        """Encodes public messages once and hands them to the sender thread for every spectator."""
+        if not self.spectators or not messages:
+            return
+        frame = protocol.encode_frame(messages)
+        snapshot = None
+        if self.needs_snapshot:
+            # taken after the frame's changes, so it can replace the frame
+            self.needs_snapshot = False
+            snapshot = self.snapshot_frame()
+        with self.lock:
+            self.pending.append((frame, snapshot))
+            self.delivered.clear()
+        self.sender.call(self.deliver_pending)
+
+    def deliver_pending(self):
+        """Queues the published frames to every spectator; runs on the sender thread."""
+        with self.lock:
+            pending, self.pending = self.pending, []
+            spectators = list(self.spectators)
+        for frame, snapshot in pending:
+            for spectator in spectators:
+                self.deliver(spectator, frame, snapshot)
+        with self.lock:
+            self.spectators = [spectator for spectator in self.spectators
+                               if not (spectator.connection.closing or spectator.connection.closed)]
+            self.metrics.set("spectators", len(self.spectators), **self.labels)
+            if not self.pending:
+                self.delivered.set()
+
+    def deliver(self, spectator, frame, snapshot):
+        """Queues a frame to one spectator, applying the policy if they fell behind."""
+        connection = spectator.connection
+        if connection.closing or connection.closed:
+            return
+        if spectator.stale:
+            if snapshot is not None and connection.buffered() <= self.max_buffer // 2:
+                connection.write(snapshot)
+                spectator.stale = False
+            else:
+                # not caught up yet: offer a snapshot again with the next update
+                self.needs_snapshot = True
+            return
+        if connection.buffered() + len(frame) > self.max_buffer:
+            if self.policy == DISCONNECT:
+                self.metrics.inc("spectator_disconnects_total", **self.labels)
+                connection.close()
+                return
+            self.metrics.inc("spectator_drops_total", **self.labels)
+            spectator.stale = True
+            self.needs_snapshot = True
+            return
+        connection.write(frame)
+
+    def snapshot_frame(self):
+        """Returns the encoded spectator snapshot, encoded once per state version."""
+        seq, frame = self.snapshot
+        if seq != self.state_model.seq:
+            frame = protocol.encode_frame([self.state_model.snapshot(self.viewer)])
+            self.snapshot = (self.state_model.seq, frame)
+        return frame
+
+    def close(self, timeout=5.0):
+        """Closes every spectator connection, giving them up to timeout seconds to receive what was published."""
+        deadline = time.monotonic() + timeout
+        self.delivered.wait(timeout)
+        with self.lock:
+            spectators, self.spectators = self.spectators, []
+        for spectator in spectators:
+            spectator.connection.drain(max(0.0, deadline - time.monotonic()))
+            spectator.connection.close()
+
+
+def key_matches(given, key):
+    """Checks a spectator's key against the server's in constant time."""
+    return isinstance(given, str) and secrets.compare_digest(given.encode(), key.encode())
+
+
+class SocketConnection:
+    """Queue of frames for one non-blocking socket, written by a SocketSender thread."""
+    def __init__(self, sock, sender):
+        sock.setblocking(False)
+        self.sock = sock
+        self.sender = sender
+        self.lock = threading.Lock()
+        self.frames = collections.deque()
+        self.buffered_bytes = 0
+        self.closed = False
+        self.closing = False
+        self.empty = threading.Event()
+        self.empty.set()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def write(self, frame):
+        """Queues a frame; never blocks on the socket."""
+        with self.lock:
+            if self.closed or self.closing:
+                return
+            self.frames.append(frame)
+            self.buffered_bytes += len(frame)
+            self.empty.clear()
+        self.sender.notify(self)
+
+    def buffered(self):
+        return self.buffered_bytes
+
+    def drain(self, timeout):
+        """Waits up to timeout seconds for the queued frames to be written."""
+        return self.empty.wait(timeout)
+
+    def close(self):
+        """Drops anything not yet written and closes the socket from the sender thread."""
+        with self.lock:
+            self.closing = True
+            self.frames.clear()
+            self.buffered_bytes = 0
+            self.empty.set()
+        self.sender.notify(self)
+
+    def send_some(self):
+        """Writes as much as the socket takes; returns True once nothing is left to write."""
+        with self.lock:
+            try:
+                while self.frames:
+                    frame = self.frames[0]
+                    sent = self.sock.send(frame)
+                    self.buffered_bytes -= sent
+                    if sent < len(frame):
+                        self.frames[0] = frame[sent:]
+                        return False
+                    self.frames.popleft()
+            except BlockingIOError:
+                return False
+            except OSError:
+                self.closed = True
+                self.frames.clear()
+                self.buffered_bytes = 0
+            self.empty.set()
+            return True
+
+
+class SocketSender:
+    """Background thread that writes every SocketConnection's queue with non-blocking sends."""
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.ready = set()
+        self.calls = collections.deque()
+        self.wakeup, self.waker = socket.socketpair()
+        self.wakeup.setblocking(False)
+        self.waker.setblocking(False)
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def notify(self, connection):
+        """Tells the sender thread that a connection has something to write or should be closed."""
+        with self.lock:
+            idle = not self.ready and not self.calls
+            self.ready.add(connection)
+        if idle:
+            self.wake()
+
+    def call(self, function):
+        """Runs function on the sender thread, in the order of the calls."""
+        with self.lock:
+            idle = not self.ready and not self.calls
+            self.calls.append(function)
+        if idle:
+            self.wake()
+
+    def wake(self):
+        # one wakeup is enough however many connections get ready before the thread runs
+        try:
+            self.waker.send(b"\0")
+        except BlockingIOError:
+            pass
+
+    def run(self):
+        waiting = set()
+        while True:
+            for key, _ in self.selector.select():
+                if key.fileobj is self.wakeup:
+                    try:
+                        while self.wakeup.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    with self.lock:
+                        self.ready.add(key.fileobj)
+            with self.lock:
+                calls, self.calls = self.calls, collections.deque()
+            for function in calls:
+                function()
+            with self.lock:
+                ready, self.ready = self.ready, set()
+            for connection in ready:
+                done = connection.closed or connection.send_some()
+                if done and connection in waiting:
+                    self.selector.unregister(connection)
+                    waiting.discard(connection)
+                elif not done and connection not in waiting:
+                    self.selector.register(connection, selectors.EVENT_WRITE)
+                    waiting.add(connection)
+                if done and (connection.closing or connection.closed):
+                    connection.closed = True
+                    connection.sock.close()
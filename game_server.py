@@ -1,43 +1,113 @@
+import asyncio
+import os
 import socket
 import threading
+import collections
 import concurrent.futures
-import select
+import selectors
 import errno
+import secrets
+import time
 import Hannabis as h
-import json
-
-class GameServer:
-    """Game server that handles the game logic and communication with players."""
-    def __init__(self, host, port, num_players):
+import commands
+import fanout
+import metrics as m
+import protocol
+from event_log import HEADER, EventLogReader, EventLogWriter
+from table import Table
+
+def open_game_log(log_path, num_players):
+    """Returns the path to log the game to, and the unfinished game it holds or None to start a new one.
+
+    Only the newest of log_path and the numbered logs after it (game-1.hlog,
+    game-2.hlog...) is carried on. A finished log is kept, and the next game
+    is logged under the next number. A missing log, or one torn before its
+    header was written, holds no game.
+    """
+    stem, ext = os.path.splitext(log_path)
+    number = 0
+    while os.path.exists(f"{stem}-{number + 1}{ext}"):
+        number += 1
+    path = f"{stem}-{number}{ext}" if number else log_path
+    if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+        return path, None
+    reader = EventLogReader(path)
+    try:
+        if reader.is_finished():
+            return f"{stem}-{number + 1}{ext}", None
+        if reader.number_of_players != num_players:
+            raise ValueError(f"{path} holds an unfinished game of {reader.number_of_players} players, not {num_players}.")
+        return path, reader.replay()
+    finally:
+        reader.close()
+
+class GameServer(Table):
+    """Game server that handles the game logic and communication with players.
+
+    Spectators see no hand, unless spectator_key is set: then only spectators
+    who send that key are let in, and they see every hand. If log_path holds
+    an unfinished game, the server carries on with it instead of a new one;
+    see open_game_log.
+    """
+    def __init__(self, host, port, num_players, log_path=None, metrics=None,
+                 turn_timeout=None, prompt_timeout=None, timeout_action=commands.default_timeout_action,
+                 spectator_port=None, spectator_policy=fanout.SNAPSHOT, reconnect_grace=30.0,
+                 bots=0, scheduler=None, spectator_key=None):
+        game_logic = None
+        if log_path:
+            log_path, game_logic = open_game_log(log_path, num_players)
+        super().__init__(num_players, game_logic, metrics=metrics, turn_timeout=turn_timeout, prompt_timeout=prompt_timeout,
+                         timeout_action=timeout_action, spectator_policy=spectator_policy,
+                         reconnect_grace=reconnect_grace, bots=bots, scheduler=scheduler,
+                         spectator_hands=spectator_key is not None)
         self.host = host
         self.port = port
-        self.num_players = num_players
-        self.game_logic = h.GameLogic(num_players)
-        self.lock = threading.Lock()
+        # never start over the log of a game that was cut short, or of one that has ended
+        self.event_log = EventLogWriter(log_path, self.game_logic, resume=self.resumed) if log_path else None
+        if self.resumed:
+            print(f"Resuming the game of {log_path} at round {self.game_logic.round}...")
+        self.lock = m.make_lock(self.metrics)
         self.player_ids = {} 
         self.next_player_id = 1
-        self.players_connected = 0
+        self.players_connected = len(self.bot_seats)
         self.all_players_connected = threading.Condition(self.lock) 
         self.player_responses = {} 
-        self.response_condition = threading.Condition(self.lock) 
+        self.response_conditions = {}
+        self.connections = {}
+        self.sender = None
+        self.spectator_port = spectator_port
+        self.spectator_key = spectator_key
+        self.sessions = {}
+        self.resuming = {}
+        self.stopped = threading.Event()
 
     def start(self):
         """Starts the server and waits for players to connect."""
         print("Starting server...")
-        print(f"Waiting for {self.num_players} players to connect...")
+        print(f"Waiting for {self.num_players - len(self.bot_seats)} players to connect...")
+        self.sender = fanout.SocketSender()
+        if self.spectator_port is not None:
+            threading.Thread(target=self.accept_spectators, daemon=True).start()
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
             server_socket.setblocking(False)
             server_socket.bind((self.host, self.port))
             server_socket.listen(self.num_players)
 
+            # a selector rather than select(), which fails on fds past 1024 once spectators are connected
+            selector = selectors.DefaultSelector()
+            selector.register(server_socket, selectors.EVENT_READ)
             with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_players) as executor:
                 while self.players_connected < self.num_players:
-                    readable, _, _ = select.select([server_socket] + list(self.player_ids.values()), [], [])
-                    for s in readable:
-                        if s is server_socket:
+                    for key, _ in selector.select():
+                        if key.fileobj is server_socket:
                             player_socket, address = server_socket.accept()
                             player_socket.setblocking(False)
                             self.player_ids[self.next_player_id] = player_socket
+                            self.connections[self.next_player_id] = fanout.SocketConnection(player_socket, self.sender)
+                            self.outboxes[self.next_player_id] = []
+                            self.player_responses[self.next_player_id] = collections.deque()
+                            self.response_conditions[self.next_player_id] = threading.Condition(self.lock)
+                            self.open_session(self.next_player_id)
                             executor.submit(self.handle_player, player_socket, self.next_player_id)
                             with self.lock:
                                 self.players_connected += 1
@@ -51,64 +121,151 @@ class GameServer:
                     while self.players_connected < self.num_players:
                         self.all_players_connected.wait()
 
+                # from now on every connection is a player coming back
+                threading.Thread(target=self.accept_reconnections, args=(server_socket, selector), daemon=True).start()
                 # start the game
                 self.start_game()
 
     def start_game(self):
         """Starts the game and handles the game logic."""
-        # start the game
-        self.broadcast("Starting the game...")
-        self.broadcast(f"Hello! There are {self.num_players} players in the game.")
-
-        # Assign and notify player IDs
-        for player_id in range(1, self.num_players + 1):
-            self.send_message_to_player(player_id, f"Your player ID is {player_id}.")
-
-        # Start the rounds
-        while not self.game_logic.is_game_over():
-            self.broadcast(f"\n--- Round {self.game_logic.round} ---\n")
-            for player_id in range(1, self.num_players + 1):
-                self.broadcast(f"Player {player_id}'s turn.\n")
-                self.broadcast(f"Information tokens: {self.game_logic.shared_tokens['info_tokens']}, Fuse tokens: {self.game_logic.shared_tokens['fuse_tokens']}\n")
-
-                # Send each player their view of other players' hands
-                for view_id in range(1, self.num_players + 1):
-                    hands_info = self.game_logic.show_other_players_hands(view_id)
-                    self.send_message_to_player(view_id, f"Other players' hands:\n{hands_info}\n")
-
-                # Ask for player action
-                action = self.get_player_action(player_id)
-                # Do the action
-                if action == "play_card" or action == "1":
-                    print('player ' + str(player_id) + ' chose to play card')
-                    card = self.which_card_to_play(player_id)
-                    self.play_card_action(player_id, card)
-
-                elif action == "give_info" or action == "2":
-                    print('player ' + str(player_id) + ' chose to give info')
-                    self.give_information_action(player_id)
-
-                if self.game_logic.is_game_over():
-                    print('game over')
-                    break
-            self.game_logic.round += 1
-        self.broadcast("Game concluded.")
+        # the turn flow runs on a loop of this thread's own, where blocking waits hold up no one else
+        asyncio.run(self.play())
+        self.flush()
+        self.audience.close()
+        self.stopped.set()
+
+    def accept_spectators(self):
+        """Accepts spectators for as long as the server runs; they get every public update."""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as spectator_socket:
+            spectator_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            spectator_socket.bind((self.host, self.spectator_port))
+            spectator_socket.listen(128)
+            while True:
+                sock, address = spectator_socket.accept()
+                if self.spectator_key is None:
+                    self.audience.add(fanout.SocketConnection(sock, self.sender))
+                else:
+                    threading.Thread(target=self.seat_spectator, args=(sock,), daemon=True).start()
+
+    def seat_spectator(self, sock):
+        """Reads a spectator's first message and lets them watch if it carries the spectator key."""
+        decoder = protocol.FrameDecoder()
+        messages = []
+        try:
+            sock.settimeout(10.0)
+            while not messages:
+                data = sock.recv(1024)
+                if not data:
+                    sock.close()
+                    return
+                messages = decoder.feed(data)
+        except (OSError, protocol.ProtocolError):
+            sock.close()
+            return
+        if messages[0]["type"] != "spectate" or not fanout.key_matches(messages[0].get("key"), self.spectator_key):
+            try:
+                sock.sendall(protocol.encode_frame([protocol.make_message("error", "Wrong spectator key.")]))
+            except OSError:
+                pass
+            sock.close()
+            return
+        self.audience.add(fanout.SocketConnection(sock, self.sender))
+
+    def open_session(self, player_id):
+        """Gives a new player the token that lets them take their seat back after a disconnect."""
+        token = secrets.token_urlsafe(16)
+        self.sessions[token] = player_id
+        self.connections[player_id].write(protocol.encode_frame([protocol.make_message("session", token=token, player=player_id)]))
+
+    def accept_reconnections(self, server_socket, selector):
+        """Accepts players coming back to their seat until the game ends."""
+        while not self.stopped.is_set():
+            if not selector.select(1.0):
+                continue
+            try:
+                sock, address = server_socket.accept()
+            except OSError:
+                continue
+            threading.Thread(target=self.resume_player, args=(sock,), daemon=True).start()
+
+    def resume_player(self, sock):
+        """Reads the session token of a returning player and hands their socket to the game thread."""
+        decoder = protocol.FrameDecoder()
+        messages = []
+        try:
+            sock.settimeout(10.0)
+            while not messages:
+                data = sock.recv(1024)
+                if not data:
+                    sock.close()
+                    return
+                messages = decoder.feed(data)
+        except (OSError, protocol.ProtocolError):
+            sock.close()
+            return
+        player_id = self.sessions.get(messages[0].get("token")) if messages[0]["type"] == "join" else None
+        if player_id is None or self.stopped.is_set():
+            try:
+                sock.sendall(protocol.encode_frame([protocol.make_message("error", "Unknown or expired session.")]))
+            except OSError:
+                pass
+            sock.close()
+            return
+        sock.setblocking(False)
+        with self.lock:
+            self.resuming[player_id] = sock
+            # the game thread seats them the next time it waits for anyone
+            for condition in self.response_conditions.values():
+                condition.notify()
 
+    def resume_players(self):
+        """Seats the players who came back and sends each one snapshot of their view."""
+        with self.lock:
+            resuming, self.resuming = self.resuming, {}
+        for player_id, player_socket in resuming.items():
+            old_socket = self.player_ids.get(player_id)
+            if old_socket is not None:
+                # the old connection is still open, so wake its reader up to retire it
+                try:
+                    old_socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            connection = fanout.SocketConnection(player_socket, self.sender)
+            with self.lock:
+                self.player_ids[player_id] = player_socket
+                self.connections[player_id] = connection
+            self.mark_reconnected(player_id)
+            threading.Thread(target=self.handle_player, args=(player_socket, player_id), daemon=True).start()
+        self.flush()
 
     def handle_player(self, player_socket, player_id):
         """Handles the player's socket connection."""
+        decoder = protocol.FrameDecoder()
+        connection = self.connections[player_id]
+        selector = selectors.DefaultSelector()
+        selector.register(player_socket, selectors.EVENT_READ)
         try:
-            while not self.game_logic.is_game_over():
+            while not self.stopped.is_set():
                 try:
+                    # sleep in the selector instead of spinning on EWOULDBLOCK
+                    if not selector.select(1.0):
+                        continue
                     data = player_socket.recv(1024)
                     if not data:
                         break
 
-                    message = data.decode()
-                    # Detect if the player is sending a response to a request
-                    with self.lock:
-                        self.player_responses[player_id] = message
-                        self.response_condition.notify_all()
+                    try:
+                        messages = decoder.feed(data)
+                    except protocol.ProtocolError as e:
+                        self.send_message_to_player(player_id, str(e), "error")
+                        self.flush_player(player_id)
+                        continue
+                    # Queue every response in order and wake only this player's waiter
+                    responses = [(m.get("prompt"), m.get("text", "")) for m in messages if m["type"] == "response"]
+                    if responses:
+                        with self.lock:
+                            self.player_responses[player_id].extend(responses)
+                            self.response_conditions[player_id].notify()
 
                 except socket.error as e:
                     if e.errno in (errno.EWOULDBLOCK, errno.EAGAIN):
@@ -118,143 +275,87 @@ class GameServer:
         except Exception as e:
             print(f"Error in handling player socket {player_id}: {e}")
         finally:
-            player_socket.close()
-            with self.lock:
-                del self.player_ids[player_id]
-
-    def get_player_action(self, player_id):
-        """ask and check for player action"""
-        valid_actions = {"1", "2", "play_card", "give_info"}
-        while True:
-            with self.lock:
-                self.player_responses[player_id] = None
-            self.send_message_to_player(player_id, "Choose action (1: play_card, 2: give_info): ")
-            self.send_message_to_player(player_id, "(Please type it in terminal.)")
-
-            action = self.wait_for_player_response(player_id)
-
-            if action in valid_actions:
-                return action
-            else:
-                self.send_message_to_player(player_id, "Invalid action. Please enter '1' for play_card or '2' for give_info.")
-
-    def which_card_to_play(self, player_id):
-        """ask and check for which card to play"""
-        valid_cards = {"a", "b", "c", "d", "e"}
-        while True:
+            # let the last frames reach the player before closing
+            selector.close()
+            connection.drain(5.0)
+            connection.close()
             with self.lock:
-                self.player_responses[player_id] = None
-            self.send_message_to_player(player_id, "Which card to play (a-e): ")
-            self.send_message_to_player(player_id, "(Please type it in terminal.)") # tell player to open input
-
-            card = self.wait_for_player_response(player_id)
+                # unless they already came back on a new connection
+                current = self.player_ids.get(player_id) is player_socket
+                if current:
+                    del self.player_ids[player_id]
+                dropped = current and not self.stopped.is_set()
+            if dropped:
+                self.mark_disconnected(player_id)
+                # the game thread sends the news to the others, whoever it is waiting for
+                with self.lock:
+                    for condition in self.response_conditions.values():
+                        condition.notify()
 
-            if card in valid_cards:
-                return card
-            else:
-                self.send_message_to_player(player_id, "Invalid card. Please enter a valid card (a-e).")
+    async def ask(self, player_id, prompt):
+        """Sends a prompt to a player and waits for the answer."""
+        self.prompt_player(player_id, prompt)
+        try:
+            return self.wait_for_player_response(player_id)
+        finally:
+            del self.prompts[player_id]
 
-    def play_card_action(self, player_id, card_letter):
-        """play and check for card action"""
-        card_index = ord(card_letter.lower()) - ord('a')
-        hand = self.game_logic.shared_hands[player_id]
-        # check if card index is valid
-        if card_index < 0 or card_index >= len(hand):
-            self.broadcast(f"Player {player_id}: Invalid card selection.")
-            return
-        card = hand.pop(card_index)
-        if self.game_logic.is_play_valid(card):
-            self.broadcast(f"Player {player_id} played {card} successfully.")
-            if card.number == 5:
-                self.game_logic.shared_tokens['info_tokens'] += 1
-        else:
-            self.broadcast(f"Player {player_id} played {card}, but it was not valid.")
-            self.game_logic.shared_tokens['fuse_tokens'] -= 1
-        self.game_logic.played_cards.append(card)
-        if self.game_logic.deck:
-            new_card = self.game_logic.deck.pop()
-            hand.insert(card_index, new_card)
+    def wait_for_player_response(self, player_id):
+        """wait and return the player's next response, raising TurnTimeout after the deadline
+        and ConnectionError once a disconnected player's grace period is over"""
+        deadline = self.turn_deadline
+        if self.prompt_timeout:
+            prompt_deadline = time.monotonic() + self.prompt_timeout
+            deadline = min(deadline, prompt_deadline) if deadline else prompt_deadline
+        with self.metrics.timer("decision_seconds", player=player_id):
+            while True:
+                if self.resuming:
+                    self.resume_players()
+                if self.public_messages:
+                    self.flush()
+                with self.response_conditions[player_id]:
+                    if self.player_responses[player_id]:
+                        prompt_id, response = self.player_responses[player_id].popleft()
+                        if self.answers_open_prompt(player_id, prompt_id):
+                            return response
+                        continue
+                    if self.resuming or self.public_messages:
+                        continue
+                    now = time.monotonic()
+                    if deadline is not None and deadline <= now:
+                        raise commands.TurnTimeout(f"Player {player_id} did not answer in time.")
+                    timeout = deadline - now if deadline else None
+                    if player_id in self.disconnected:
+                        grace = self.disconnected[player_id] + self.reconnect_grace - now
+                        if grace <= 0:
+                            raise ConnectionError(f"Player {player_id} disconnected.")
+                        timeout = grace if timeout is None else min(timeout, grace)
+                    self.response_conditions[player_id].wait(timeout)
+    
 
-    def ask_for_target_player_id(self, current_player_id):
-        """ask and check for target player id"""
-        valid_ids = [id for id in range(1, self.num_players + 1) if id != current_player_id]
+    def discard_responses(self, player_id):
+        """empty a player's inbox"""
         with self.lock:
-            self.player_responses[current_player_id] = None
-        while True:
-            with self.lock:
-                self.player_responses[current_player_id] = None
-            self.send_message_to_player(current_player_id, f"Enter the target player ID to give information to (options: {', '.join(map(str, valid_ids))}): ")
-            self.send_message_to_player(current_player_id, "(Please type it in terminal.)")
-            target_id = self.wait_for_player_response(current_player_id)
-            if target_id in map(str, valid_ids):
-                return int(target_id)
-            else:
-                self.send_message_to_player(current_player_id, "Invalid player ID. Please choose from the given options.")
+            self.player_responses[player_id].clear()
 
-    def ask_for_information_type(self, current_player_id):
-        """ask and check for information type"""
-        valid_colors = self.game_logic.get_valid_colors()
+    def flush_player(self, player_id):
+        """queue a player's messages as one frame for the sender thread"""
         with self.lock:
-            self.player_responses[current_player_id] = None
-        while True:
-            with self.lock:
-                self.player_responses[current_player_id] = None
-            self.send_message_to_player(current_player_id, "Enter the information to give (color or number): ")
-            self.send_message_to_player(current_player_id, "(Please type it in terminal.)")
-            info = self.wait_for_player_response(current_player_id)
-            if info.isdigit() and 1 <= int(info) <= 5:
-                return info
-            elif info.capitalize() in valid_colors:
-                return info.capitalize()
-            else:
-                self.send_message_to_player(current_player_id, "Invalid information type. Please enter a valid color or number.")
-
-    def give_information_action(self, current_player_id):
-        """give and check for information action"""
-        if self.game_logic.shared_tokens['info_tokens'] <= 0:
-            self.broadcast("No information tokens available.")
+            messages = self.outboxes[player_id]
+            if not messages:
+                return
+            self.outboxes[player_id] = []
+            connection = self.connections.get(player_id)
+        if connection is None or connection.closed:
+            self.metrics.inc("send_failures_total", player=player_id)
             return
-
-        target_player_id = self.ask_for_target_player_id(current_player_id)
-        info = self.ask_for_information_type(current_player_id)
-        informed_cards = self.game_logic.get_informed_cards(target_player_id, info)
-        if informed_cards:
-            self.game_logic.shared_tokens['info_tokens'] -= 1
-            card_positions = ', '.join(informed_cards).lower()
-            self.send_message_to_player(target_player_id, f"Player {target_player_id}, your cards {card_positions} are {info}.")
-            self.broadcast(f"Information tokens left: {self.game_logic.shared_tokens['info_tokens']}")
-        else:
-            self.send_message_to_player(current_player_id, "Invalid information provided. Please try again.")
-
-
-    def wait_for_player_response(self, player_id):
-        """wait and return player response"""
-        with self.response_condition:
-            while self.player_responses[player_id] is None:
-                self.response_condition.wait()
-        return self.player_responses[player_id]
-    
-
-    def broadcast(self, message):
-        """broadcast message to all players"""
-        with self.lock:
-            for player_socket in self.player_ids.values():
-                try:
-                    player_socket.sendall(message.encode())
-                except Exception as e:
-                    print(f"Error broadcasting to player {player_socket}: {e}")
-    
-    def send_message_to_player(self, player_id, message):
-        """send message to a player"""
-        try:
-            self.player_ids[player_id].sendall(message.encode())
-        except Exception as e:
-            print(f"Error sending message to player {self.player_ids[player_id]}: {e}")
+        with self.metrics.timer("send_seconds", player=player_id):
+            connection.write(protocol.encode_frame(messages))
 
 
 
 # Example usage
 if __name__ == "__main__":
     num_players = h.get_number_of_players()
-    server = GameServer("localhost", 12330, num_players)
+    server = GameServer("localhost", 12330, num_players, spectator_port=12331)
     server.start()
\ No newline at end of file
@@ -0,0 +1,184 @@
+import Hannabis as h
+import protocol
+
+# Changes carried by delta messages:
+# - {"op": "turn", "player": p, "round": r}
+# - {"op": "remove", "player": p, "position": i, "card": "Red1"}
+# - {"op": "draw", "player": p, "position": i, "card": "Red1" or None for the drawer}
+# - {"op": "tokens", "info": x, "fuse": y}
+# - {"op": "firework", "color": c, "height": n}
+# - {"op": "hint", "player": p, "target": t, "info": info, "positions": ["a", "c"]}
+
+# Viewer IDs of spectators, who have no seat: they see every hand, or none.
+ALL_HANDS = 0
+NO_HANDS = -1
+
+class GameStateModel:
+    """Versioned view of a GameLogic that hands out per-viewer snapshots and deltas."""
+    def __init__(self, game_logic):
+        self.game_logic = game_logic
+        self.seq = 0
+        self.turn = None
+        self.snapshots = {}
+
+    def snapshot(self, viewer_id):
+        """Returns the full state viewer_id can see, rebuilt only after it changed."""
+        cached = self.snapshots.get(viewer_id)
+        if cached is not None and cached["seq"] == self.seq:
+            return cached
+        game = self.game_logic
+        hands = {str(id): [None if id == viewer_id or viewer_id == NO_HANDS else str(card) for card in hand]
+                 for id, hand in game.shared_hands.items()}
+        snapshot = protocol.make_message("snapshot", seq=self.seq, viewer=viewer_id, turn=self.turn, round=game.round,
+                                         info_tokens=game.shared_tokens['info_tokens'],
+                                         fuse_tokens=game.shared_tokens['fuse_tokens'],
+                                         fireworks=dict(game.fireworks), hands=hands,
+                                         knowledge={str(id): list(masks) for id, masks in game.knowledge.items()})
+        self.snapshots[viewer_id] = snapshot
+        return snapshot
+
+    def start_turn(self, player_id):
+        """Records that player_id is to move and returns the delta for every viewer."""
+        self.turn = player_id
+        return self.next_delta([{"op": "turn", "player": player_id, "round": self.game_logic.round}])
+
+    def record(self, events):
+        """Turns engine events into deltas.
+
+        Returns (delta, hidden): the delta every viewer gets, and a
+        {viewer_id: delta} of the viewers who must get a variant with their
+        own drawn cards hidden. NO_HANDS gets one with every drawn card hidden.
+        """
+        changes = []
+        drawers = set()
+        for event in events:
+            if event[0] == 'play':
+                _, player_id, card_index, card, success = event
+                changes.append({"op": "remove", "player": player_id, "position": card_index, "card": str(card)})
+                if success:
+                    changes.append({"op": "firework", "color": card.color, "height": card.number})
+            elif event[0] == 'draw':
+                _, player_id, card_index, card = event
+                changes.append({"op": "draw", "player": player_id, "position": card_index, "card": str(card)})
+                drawers.add(player_id)
+            elif event[0] == 'hint':
+                _, player_id, target_player_id, info, positions = event
+                changes.append({"op": "hint", "player": player_id, "target": target_player_id, "info": info, "positions": positions})
+            elif event[0] == 'tokens':
+                changes.append({"op": "tokens", "info": event[1], "fuse": event[2]})
+        delta = self.next_delta(changes)
+        hidden = {}
+        for viewer_id in (drawers | {NO_HANDS}) if drawers else ():
+            hidden_changes = [dict(change, card=None) if change["op"] == "draw" and viewer_id in (change["player"], NO_HANDS) else change
+                              for change in changes]
+            hidden[viewer_id] = dict(delta, changes=hidden_changes)
+        return delta, hidden
+
+    def next_delta(self, changes):
+        self.seq += 1
+        return protocol.make_message("delta", seq=self.seq, changes=changes)
+
+
+class GameView:
+    """One viewer's copy of the table, kept current from snapshot and delta messages."""
+    def __init__(self):
+        self.seq = None
+        self.viewer = None
+        self.turn = None
+        self.round = None
+        self.info_tokens = None
+        self.fuse_tokens = None
+        self.fireworks = {}
+        self.hands = {}
+        self.knowledge = {}
+        self.hints = []
+        self.rendered_hands = None
+
+    def apply(self, message):
+        """Applies a snapshot or delta message and returns the changes it carried."""
+        if message["type"] == "snapshot":
+            self.apply_snapshot(message)
+            return []
+        if self.seq is None or message["seq"] != self.seq + 1:
+            raise protocol.ProtocolError(f"Missed an update: expected {self.seq + 1 if self.seq is not None else 'a snapshot'}, got {message['seq']}.")
+        self.seq = message["seq"]
+        for change in message["changes"]:
+            self.apply_change(change)
+        return message["changes"]
+
+    def apply_snapshot(self, message):
+        self.seq = message["seq"]
+        self.viewer = message["viewer"]
+        self.turn = message["turn"]
+        self.round = message["round"]
+        self.info_tokens = message["info_tokens"]
+        self.fuse_tokens = message["fuse_tokens"]
+        self.fireworks = dict(message["fireworks"])
+        self.hands = {int(id): list(hand) for id, hand in message["hands"].items()}
+        self.knowledge = {int(id): list(masks) for id, masks in message["knowledge"].items()}
+        self.hints = []
+        self.rendered_hands = None
+
+    def apply_change(self, change):
+        op = change["op"]
+        if op == "turn":
+            self.turn = change["player"]
+            self.round = change["round"]
+        elif op == "remove":
+            self.hands[change["player"]].pop(change["position"])
+            self.knowledge[change["player"]].pop(change["position"])
+            self.invalidate(change["player"])
+        elif op == "draw":
+            self.hands[change["player"]].insert(change["position"], change["card"])
+            self.knowledge[change["player"]].insert(change["position"], h.full_mask(len(self.fireworks)))
+            self.invalidate(change["player"])
+        elif op == "tokens":
+            self.info_tokens = change["info"]
+            self.fuse_tokens = change["fuse"]
+        elif op == "firework":
+            self.fireworks[change["color"]] = change["height"]
+        elif op == "hint":
+            self.hints.append(change)
+            h.narrow_knowledge(self.knowledge[change["target"]], change["info"], change["positions"])
+
+    def possible_cards(self, player_id, position):
+        """Returns the cards the card at position in player_id's hand may be, as far as everyone knows."""
+        return h.possible_cards(self.knowledge[player_id][position])
+
+    def describe_knowledge(self, player_id):
+        """Describes what is known of each card in a hand, such as 'Red?' or '?3'."""
+        labels = []
+        for mask in self.knowledge.get(player_id, []):
+            cards = h.possible_cards(mask)
+            colors = {card.color for card in cards}
+            numbers = {card.number for card in cards}
+            labels.append((colors.pop() if len(colors) == 1 else "?") + (str(numbers.pop()) if len(numbers) == 1 else "?"))
+        return labels
+
+    def legal_actions(self):
+        """Returns every action the viewer may take, in the form GameLogic.legal_actions uses."""
+        actions = [('play', i) for i in range(len(self.hands.get(self.viewer, [])))]
+        if self.info_tokens:
+            infos = list(self.fireworks) + ['1', '2', '3', '4', '5']
+            for target_player_id, hand in self.hands.items():
+                if target_player_id == self.viewer:
+                    continue
+                present = {card[:-1] for card in hand} | {card[-1] for card in hand}
+                actions.extend(('hint', target_player_id, info) for info in infos if info in present)
+        return actions
+
+    def invalidate(self, player_id):
+        """Drops the cached hands text if the changed hand is one this viewer can see."""
+        if player_id != self.viewer:
+            self.rendered_hands = None
+
+    def render(self):
+        """Renders the turn header the terminal client shows."""
+        if self.rendered_hands is None:
+            # a spectator who sees no hand gets ?? for every card
+            self.rendered_hands = "\n".join(f"Player {id}: {', '.join(card or '??' for card in hand)}" for id, hand in self.hands.items() if id != self.viewer)
+        own_hand = ", ".join(f"{chr(97 + i)}: {label}" for i, label in enumerate(self.describe_knowledge(self.viewer)))
+        return (f"Player {self.turn}'s turn.\n"
+                f"Information tokens: {self.info_tokens}, Fuse tokens: {self.fuse_tokens}\n"
+                f"Other players' hands:\n{self.rendered_hands}\n"
+                f"What you know of your hand: {own_hand}\n")
@@ -0,0 +1,263 @@
+import bisect
+import collections
+import contextlib
+import http.server
+import os
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+PREFIX = "hannabis_"
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+class Metrics:
+    """Counters and histograms keyed by name and labels, rendered in Prometheus text format."""
+    enabled = True
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = collections.defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """Adds value to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def set(self, name, value, **labels):
+        """Sets a gauge to value."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = value
+
+    def observe(self, name, value, **labels):
+        """Records one sample in a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def remove(self, **labels):
+        """Drops every series carrying the given labels, such as a finished table's.
+
+        Counters and histograms are folded into the series without those
+        labels, so totals keep counting what the dropped series had seen;
+        gauges are dropped.
+        """
+        dropped = set(labels.items())
+        with self.lock:
+            for key in [key for key in self.counters if dropped <= set(key[1])]:
+                value = self.counters.pop(key)
+                name, rest = key[0], tuple(item for item in key[1] if item not in dropped)
+                if name.endswith("_total"):
+                    self.counters[(name, rest)] += value
+            for key in [key for key in self.histograms if dropped <= set(key[1])]:
+                counts, total, count = self.histograms.pop(key)
+                folded = self.histograms.setdefault((key[0], tuple(item for item in key[1] if item not in dropped)),
+                                                    [[0] * (len(self.buckets) + 1), 0.0, 0])
+                folded[0] = [a + b for a, b in zip(folded[0], counts)]
+                folded[1] += total
+                folded[2] += count
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observes how long the with-block took, in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self):
+        """Returns every metric in Prometheus text exposition format."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self.histograms.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.append(f"{PREFIX}{name}{format_labels(labels)} {value:g}")
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{PREFIX}{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {total:g}")
+            lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class NullMetrics:
+    """Stand-in used when metrics are disabled; every hook does nothing."""
+    enabled = False
+    _timer = contextlib.nullcontext()
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def set(self, name, value, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def remove(self, **labels):
+        pass
+
+    def timer(self, name, **labels):
+        return self._timer
+
+    def render(self):
+        return ""
+
+DISABLED = NullMetrics()
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class TimedLock:
+    """Lock that records how long callers waited for it when it was contended."""
+    def __init__(self, metrics, name="lock_wait_seconds"):
+        self.metrics = metrics
+        self.name = name
+        self.lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        started = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        self.metrics.observe(self.name, time.perf_counter() - started)
+        self.metrics.inc("lock_contended_total")
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+def make_lock(metrics):
+    """Returns a plain lock, or a TimedLock when metrics are enabled."""
+    return TimedLock(metrics) if metrics.enabled else threading.Lock()
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread at a fixed interval and counts collapsed stacks."""
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.samples.clear()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops sampling and returns the samples as collapsed stacks, one per line."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def run(self):
+        own_id = threading.get_ident()
+        while self.running:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = traceback.extract_stack(frame)
+                self.samples[";".join(f"{os.path.basename(f.filename)}:{f.name}" for f in stack)] += 1
+            time.sleep(self.interval)
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serves /metrics, /profile/start and /profile/stop."""
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.reply(self.server.metrics.render(), "text/plain; version=0.0.4")
+        elif self.path == "/profile/start":
+            self.server.profiler.start()
+            self.reply("profiling\n")
+        elif self.path == "/profile/stop":
+            self.reply(self.server.profiler.stop())
+        else:
+            self.send_error(404)
+
+    def reply(self, text, content_type="text/plain"):
+        body = text.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TCPMetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class UnixMetricsServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """Local metrics endpoint on a localhost port or a Unix socket, served from a background thread."""
+    def __init__(self, metrics, port=None, unix_path=None, host="127.0.0.1"):
+        if unix_path is not None:
+            if os.path.exists(unix_path):
+                os.unlink(unix_path)
+            self.server = UnixMetricsServer(unix_path, MetricsHandler)
+        else:
+            self.server = TCPMetricsServer((host, port if port is not None else 9100), MetricsHandler)
+        self.server.metrics = metrics
+        self.server.profiler = SamplingProfiler()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,59 @@
+import json
+
+# Every frame is one line of JSON holding a list of messages, so a whole
+# turn of output for a player goes out in a single write.
+MESSAGE_TYPES = {"text", "snapshot", "delta", "prompt", "result", "error", "response", "spectate", "session", "join"}
+MAX_FRAME_SIZE = 64 * 1024
+
+class ProtocolError(ValueError):
+    """Raised when the peer sends something that is not a valid frame."""
+
+def make_message(message_type, text=None, **fields):
+    """Builds a message of the given type."""
+    if message_type not in MESSAGE_TYPES:
+        raise ProtocolError(f"Unknown message type: {message_type}")
+    message = {"type": message_type}
+    if text is not None:
+        message["text"] = text
+    message.update(fields)
+    return message
+
+def encode_frame(messages):
+    """Encodes a list of messages into one newline-terminated frame."""
+    return (json.dumps(messages, separators=(",", ":")) + "\n").encode()
+
+class FrameDecoder:
+    """Streaming decoder that turns received bytes into messages."""
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.buffer = b""
+
+    def feed(self, data):
+        """Adds received bytes and returns the messages of every complete frame."""
+        self.buffer += data
+        messages = []
+        if b"\n" in data:
+            *lines, self.buffer = self.buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    messages.extend(decode_frame(line))
+        if len(self.buffer) > self.max_frame_size:
+            self.buffer = b""
+            raise ProtocolError("Frame too large.")
+        return messages
+
+def decode_frame(line):
+    """Decodes one frame into its list of messages."""
+    try:
+        messages = json.loads(line)
+    except ValueError as e:
+        raise ProtocolError(f"Invalid frame: {e}") from e
+    if isinstance(messages, dict):
+        messages = [messages]
+    if not isinstance(messages, list) or not all(isinstance(m, dict) and m.get("type") in MESSAGE_TYPES for m in messages):
+        raise ProtocolError("Frame must be a list of typed messages.")
+    return messages
+
+def render_message(message):
+    """Renders a text-carrying message as the terminal client shows it."""
+    return message.get("text", "")
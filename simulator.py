@@ -0,0 +1,137 @@
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import random
+import time
+import Hannabis as h
+
+# A policy is called as policy(game, player_id, rng) and returns an action
+# accepted by GameLogic.apply_action. Policies may look at every hand except
+# the player's own, of which only the length is public.
+
+def random_policy(game, player_id, rng):
+    """Picks a uniformly random legal action."""
+    return rng.choice(game.legal_actions(player_id))
+
+def hint_playable_policy(game, player_id, rng):
+    """Plays a card its knowledge shows is playable, else hints one so its holder will know, else plays a random card."""
+    hand_size = len(game.shared_hands[player_id])
+    playable = game.playable_mask()
+    masks = game.knowledge[player_id]
+    for i in range(hand_size):
+        if masks[i] & ~playable == 0:
+            return ('play', i)
+    if game.shared_tokens['info_tokens'] > 0:
+        fallback = None
+        for target_player_id, hand in game.shared_hands.items():
+            if target_player_id == player_id:
+                continue
+            known = game.knowledge[target_player_id]
+            for i, card in enumerate(hand):
+                if not playable >> card.code & 1 or known[i] & ~playable == 0:
+                    continue
+                # the hint that leaves the holder knowing the card is playable
+                for info in (str(card.number), card.color):
+                    if known[i] & h.INFO_MASKS[info] & ~playable == 0:
+                        return ('hint', target_player_id, info)
+                fallback = fallback or ('hint', target_player_id, str(card.number))
+        if fallback is not None:
+            return fallback
+    if hand_size:
+        # the card most likely to be playable, going by what the player knows of it
+        return ('play', max(range(hand_size), key=lambda i: (bin(masks[i] & playable).count('1') / bin(masks[i]).count('1'), rng.random())))
+    return random_policy(game, player_id, rng)
+
+POLICIES = {
+    'random': random_policy,
+    'hint_playable': hint_playable_policy,
+}
+
+def play_game(num_players, seed, policy, observer=None):
+    """Plays one game without any I/O and returns (score, turns).
+
+    observer, if given, is called as observer(game, player_id, events) after every action.
+    """
+    # one generator shuffles the deck, the same as GameLogic(num_players, seed), then drives the policy
+    rng = random.Random(seed)
+    game = h.GameLogic(num_players, deck=h.create_deck(num_players, rng))
+    turns = 0
+    while not game.is_game_over():
+        player_id = game.current_player
+        # a player with no cards and no tokens can only pass
+        if game.shared_hands[player_id] or game.shared_tokens['info_tokens'] > 0:
+            events = game.apply_action(player_id, policy(game, player_id, rng))
+            if observer is not None:
+                observer(game, player_id, events)
+            turns += 1
+        game.advance_turn()
+    return game.score, turns
+
+def simulate_chunk(num_players, policy_name, seeds):
+    """Plays the games for a range of seeds and returns their scores and turn counts."""
+    policy = POLICIES[policy_name]
+    scores = collections.Counter()
+    turns = 0
+    for seed in seeds:
+        score, game_turns = play_game(num_players, seed, policy)
+        scores[score] += 1
+        turns += game_turns
+    return scores, turns
+
+def run_simulation(num_games, num_players, policy_name, seed=0, workers=None):
+    """Runs num_games seeded games across a process pool and returns a report."""
+    workers = workers or os.cpu_count() or 1
+    chunk_size = max(1, num_games // (workers * 4))
+    chunks = [range(start, min(start + chunk_size, seed + num_games)) for start in range(seed, seed + num_games, chunk_size)]
+    scores = collections.Counter()
+    turns = 0
+    started = time.perf_counter()
+    if workers == 1:
+        results = (simulate_chunk(num_players, policy_name, chunk) for chunk in chunks)
+        for chunk_scores, chunk_turns in results:
+            scores.update(chunk_scores)
+            turns += chunk_turns
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(simulate_chunk, num_players, policy_name, chunk) for chunk in chunks]
+            for future in futures:
+                chunk_scores, chunk_turns = future.result()
+                scores.update(chunk_scores)
+                turns += chunk_turns
+    elapsed = time.perf_counter() - started
+    return {
+        'games': num_games,
+        'players': num_players,
+        'policy': policy_name,
+        'workers': workers,
+        'seconds': elapsed,
+        'games_per_sec': num_games / elapsed if elapsed else 0.0,
+        'mean_score': sum(score * count for score, count in scores.items()) / num_games,
+        'mean_turns': turns / num_games,
+        'score_distribution': {score: scores[score] for score in sorted(scores)},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Run seeded Hannabis games without a terminal.")
+    parser.add_argument("--games", type=int, default=10000, help="number of games to play")
+    parser.add_argument("--players", type=int, default=3, help="number of players per game (2-5)")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="hint_playable", help="bot policy used by every player")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = run_simulation(args.games, args.players, args.policy, args.seed, args.workers)
+    if args.json:
+        print(json.dumps(report))
+        return
+    print(f"{report['games']} games of {report['players']} players with the {report['policy']} policy "
+          f"on {report['workers']} workers in {report['seconds']:.2f}s ({report['games_per_sec']:.0f} games/sec)")
+    print(f"Mean score: {report['mean_score']:.2f}, mean turns: {report['mean_turns']:.1f}")
+    for score, count in report['score_distribution'].items():
+        print(f"  score {score:2d}: {count}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import secrets
+import signal
+import socket
+import metrics as m
+import protocol
+from async_server import JOIN_TIMEOUT, AsyncGameServer, load_table_tokens, logged_table_ids, table_log_path
+from event_log import EventLogReader
+
+# The lobby accepts every connection, groups players into tables and passes
+# the sockets of a full table to a worker over a Unix socket. The lobby makes
+# up the players' session tokens, so it can pass a returning player to the
+# worker hosting their table. Messages on that channel are single datagrams:
+#
+# - lobby to worker: "table <id> <token>..." carrying the player sockets in
+#   seat order, "reopen <id> <token>..." to carry on the unfinished game of
+#   the table's log instead, "resume <id> <token>..." carrying no sockets to
+#   reopen a table whose players come back on their own, "rejoin <token>"
+#   carrying a returning player's socket, or "drain"
+# - worker to lobby: "done <id>" once a table's game has ended
+
+# How long a full table waits before it is offered again when no worker could take it
+DISPATCH_RETRY_DELAY = 0.1
+# How often the lobby looks again at a join frame that only arrived in part
+JOIN_POLL_INTERVAL = 0.01
+
+def run_worker(channel, num_players, log_dir=None, turn_timeout=None, prompt_timeout=None):
+    """Entry point of a worker process: hosts the tables the lobby hands over until drained."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = AsyncGameServer(None, None, num_players, log_dir=log_dir, turn_timeout=turn_timeout, prompt_timeout=prompt_timeout)
+    asyncio.run(serve_worker(server, channel))
+
+async def serve_worker(server, channel):
+    """Starts a game for every table received on channel, then finishes them once drained."""
+    loop = asyncio.get_running_loop()
+    channel.setblocking(False)
+    received = asyncio.Queue()
+
+    def receive():
+        try:
+            data, fds, _, _ = socket.recv_fds(channel, 1024, server.num_players)
+        except BlockingIOError:
+            return
+        received.put_nowait((data, fds))
+        if not data:
+            loop.remove_reader(channel.fileno())
+
+    def report(table_id):
+        try:
+            channel.send(f"done {table_id}".encode())
+        except OSError:
+            pass
+
+    async def stop_after(games):
+        await asyncio.gather(*games, return_exceptions=True)
+        received.put_nowait((b"", []))
+
+    loop.add_reader(channel.fileno(), receive)
+    games = set()
+    players = set()
+    while True:
+        data, fds = await received.get()
+        command, _, argument = data.decode().partition(" ")
+        sockets = [socket.socket(fileno=fd) for fd in fds]
+        if command in ("table", "reopen", "resume"):
+            table_id, *tokens = argument.split()
+            table_id = int(table_id)
+            if command == "resume":
+                game = asyncio.create_task(server.host_resumed_table(table_id))
+            else:
+                game = asyncio.create_task(server.host_table(table_id, sockets, tokens, reopen=command == "reopen"))
+            game.add_done_callback(lambda task, table_id=table_id: (games.discard(task), report(table_id)))
+            games.add(game)
+        elif command == "rejoin":
+            player = asyncio.create_task(server.resume_socket(sockets[0], argument))
+            player.add_done_callback(players.discard)
+            players.add(player)
+        elif command == "drain":
+            # take no new tables, but let players back in until the games here are over
+            asyncio.create_task(stop_after(list(games)))
+        else:
+            # drained, or the lobby is gone: keep playing the games already here
+            break
+    loop.remove_reader(channel.fileno())
+    await asyncio.gather(*games, *players, return_exceptions=True)
+
+
+async def read_join(sock):
+    """Returns the join message a client starts with, or None for a client that sends anything else first.
+
+    Only the join frame is read off the socket; what follows it, and a first
+    frame that is not a join, is left there for the worker hosting the table.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + JOIN_TIMEOUT
+    try:
+        while True:
+            readable = loop.create_future()
+            loop.add_reader(sock.fileno(), lambda: readable.done() or readable.set_result(None))
+            try:
+                await asyncio.wait_for(readable, deadline - loop.time())
+            finally:
+                loop.remove_reader(sock.fileno())
+            data = sock.recv(protocol.MAX_FRAME_SIZE, socket.MSG_PEEK)
+            if not data:
+                return None
+            line, newline, _ = data.partition(b"\n")
+            if newline:
+                messages = protocol.decode_frame(line) if line.strip() else []
+                if len(messages) != 1 or messages[0]["type"] != "join":
+                    return None
+                sock.recv(len(line) + 1)
+                return messages[0]
+            if len(data) >= protocol.MAX_FRAME_SIZE:
+                return None
+            # the rest of the frame is still on its way
+            await asyncio.sleep(JOIN_POLL_INTERVAL)
+    except (asyncio.TimeoutError, protocol.ProtocolError, OSError):
+        return None
+
+
+class Worker:
+    """The lobby's handle on one worker process and the tables it hosts, with their session tokens."""
+    def __init__(self, index, process, channel):
+        self.index = index
+        self.process = process
+        self.channel = channel
+        self.tables = {}
+        self.draining = False
+
+
+class Supervisor:
+    """Pre-forks worker processes that each host many tables and routes every full table to the least loaded one."""
+    def __init__(self, host, port, num_players, workers=None, max_tables=None, log_dir=None, metrics=None,
+                 turn_timeout=None, prompt_timeout=None):
+        self.host = host
+        self.port = port
+        self.num_players = num_players
+        self.num_workers = workers or os.cpu_count() or 1
+        self.max_tables = max_tables
+        self.log_dir = log_dir
+        self.metrics = metrics or m.DISABLED
+        self.worker_options = dict(log_dir=log_dir, turn_timeout=turn_timeout, prompt_timeout=prompt_timeout)
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = []
+        self.draining = []
+        self.waiting_players = []
+        # waiting players who may still turn out to be returning ones
+        self.settling = set()
+        # tables whose game was cut short before it started, seated again before any new table
+        self.reopening = []
+        # the worker hosting each session token's table
+        self.sessions = {}
+        self.next_table_id = 1
+        # set while shutting down, when workers exiting are not to be replaced
+        self.stopping = False
+
+    def start(self):
+        """Starts the workers and the lobby and serves until interrupted."""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("Server stopped.")
+
+    async def serve(self):
+        """Accepts players and hands them to the workers a table at a time."""
+        loop = asyncio.get_running_loop()
+        print("Starting server...")
+        if self.log_dir is not None:
+            os.makedirs(self.log_dir, exist_ok=True)
+            table_ids = logged_table_ids(self.log_dir)
+            self.next_table_id = max(table_ids, default=0) + 1
+        self.workers = [self.spawn_worker(index) for index in range(self.num_workers)]
+        if self.log_dir is not None:
+            self.reopen_tables(table_ids)
+        print(f"Seating players at tables of {self.num_players} across {self.num_workers} workers...")
+        loop.add_signal_handler(signal.SIGHUP, self.restart_workers)
+        listener = socket.create_server((self.host, self.port), backlog=1024)
+        listener.setblocking(False)
+        try:
+            while True:
+                player_socket, _ = await loop.sock_accept(listener)
+                asyncio.create_task(self.handle_connection(player_socket))
+        finally:
+            listener.close()
+            self.stopping = True
+            for worker in self.workers + self.draining:
+                loop.remove_reader(worker.channel.fileno())
+                worker.process.terminate()
+
+    def spawn_worker(self, index):
+        """Starts a worker process in the given slot."""
+        lobby_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        process = self.context.Process(target=run_worker, args=(worker_end, self.num_players), kwargs=self.worker_options, daemon=True)
+        process.start()
+        worker_end.close()
+        lobby_end.setblocking(False)
+        worker = Worker(index, process, lobby_end)
+        asyncio.get_running_loop().add_reader(lobby_end.fileno(), self.handle_worker_message, worker)
+        print(f"worker {index}: started as process {process.pid}")
+        return worker
+
+    def handle_worker_message(self, worker):
+        """Tracks finished tables and replaces workers that have exited."""
+        try:
+            data = worker.channel.recv(64)
+        except BlockingIOError:
+            return
+        except ConnectionError:
+            data = b""
+        if data:
+            self.forget_table(worker, int(data.decode().split()[1]))
+            self.metrics.inc("games_total")
+            self.update_load()
+            return
+        self.replace_worker(worker)
+
+    def replace_worker(self, worker):
+        """Starts a new worker in the slot of one that has exited, or forgets it if it was draining."""
+        if self.stopping:
+            return
+        asyncio.get_running_loop().remove_reader(worker.channel.fileno())
+        worker.channel.close()
+        worker.process.join()
+        if worker in self.draining:
+            self.draining.remove(worker)
+            print(f"worker {worker.index}: drained process {worker.process.pid} exited")
+        else:
+            print(f"worker {worker.index}: process {worker.process.pid} died, losing tables {sorted(worker.tables)}")
+            self.metrics.inc("worker_restarts_total")
+            self.workers[worker.index] = self.spawn_worker(worker.index)
+        lost = sorted(worker.tables)
+        for table_id in lost:
+            self.forget_table(worker, table_id)
+        if self.log_dir is not None:
+            self.reopen_tables(lost)
+        self.update_load()
+
+    def reopen_tables(self, table_ids):
+        """Reopens the tables whose game was cut short.
+
+        A table whose game had started goes to a worker right away to wait for
+        its players, who come back with their session tokens; one that never
+        started is seated by the next full table of players.
+        """
+        for table_id in self.unfinished_tables(table_ids):
+            tokens = load_table_tokens(self.log_dir, table_id)
+            if tokens:
+                self.dispatch_table([], table_id, list(tokens.values()), "resume")
+            else:
+                self.reopening.append(table_id)
+
+    def unfinished_tables(self, table_ids):
+        """Returns the tables whose logs show an unfinished game of num_players, which can be reopened."""
+        unfinished = []
+        for table_id in table_ids:
+            try:
+                reader = EventLogReader(table_log_path(self.log_dir, table_id))
+            except (OSError, ValueError):
+                continue
+            if not reader.is_finished() and reader.number_of_players == self.num_players:
+                print(f"table {table_id}: unfinished, to be reopened")
+                unfinished.append(table_id)
+            reader.close()
+        return unfinished
+
+    def forget_table(self, worker, table_id):
+        """Drops a table that has ended, or was lost with its worker, and its sessions."""
+        for token in worker.tables.pop(table_id, ()):
+            self.sessions.pop(token, None)
+
+    def restart_workers(self):
+        """Replaces every worker; the old ones take no new tables and exit once their games end."""
+        for worker in list(self.workers):
+            self.restart_worker(worker.index)
+
+    def restart_worker(self, index):
+        """Replaces one worker without interrupting the games it is hosting."""
+        worker = self.workers[index]
+        worker.draining = True
+        self.draining.append(worker)
+        self.workers[index] = self.spawn_worker(index)
+        try:
+            worker.channel.send(b"drain")
+        except OSError:
+            pass
+        self.metrics.inc("worker_restarts_total")
+
+    def update_load(self):
+        for worker in self.workers:
+            self.metrics.set("tables", len(worker.tables), worker=worker.index)
+
+    async def handle_connection(self, player_socket):
+        """Seats a new player right away, or passes a returning one to the worker hosting their table.
+
+        A full table is only handed over once none of its players can still
+        send a join message with a session token.
+        """
+        seated = self.seat_player(player_socket)
+        join = await read_join(player_socket)
+        self.settling.discard(player_socket)
+        if join is not None and join.get("token") is not None:
+            if player_socket in self.waiting_players:
+                self.waiting_players.remove(player_socket)
+            self.rejoin(player_socket, join["token"])
+        elif not seated:
+            try:
+                player_socket.sendall(protocol.encode_frame([protocol.make_message("error", "Server is full. Please try again later.")]))
+            except OSError:
+                pass
+            player_socket.close()
+        else:
+            self.dispatch_waiting()
+
+    def rejoin(self, player_socket, token):
+        """Passes a returning player's socket to the worker hosting their table."""
+        worker = self.sessions.get(token)
+        if worker is not None:
+            try:
+                socket.send_fds(worker.channel, [f"rejoin {token}".encode()], [player_socket.fileno()])
+            except OSError:
+                pass
+            else:
+                player_socket.close()
+                return
+        try:
+            player_socket.sendall(protocol.encode_frame([protocol.make_message("error", "Unknown or expired session.")]))
+        except OSError:
+            pass
+        player_socket.close()
+
+    def seat_player(self, player_socket):
+        """Adds a player to the waiting table, unless the server is full; returns whether they were seated."""
+        tables = sum(len(worker.tables) for worker in self.workers + self.draining)
+        if self.max_tables is not None and not self.waiting_players and tables >= self.max_tables:
+            return False
+        # a player who left while waiting frees their seat again
+        self.waiting_players = [s for s in self.waiting_players if is_connected(s)]
+        self.waiting_players.append(player_socket)
+        self.settling.add(player_socket)
+        print(f"lobby: there are {len(self.waiting_players)} players waiting")
+        return True
+
+    def dispatch_waiting(self):
+        """Hands waiting tables over once they are full of players known to be new."""
+        self.waiting_players = [s for s in self.waiting_players if is_connected(s)]
+        while len(self.waiting_players) >= self.num_players and not self.settling & set(self.waiting_players[:self.num_players]):
+            self.dispatch_table(self.waiting_players[:self.num_players])
+            self.waiting_players = self.waiting_players[self.num_players:]
+
+    def dispatch_table(self, sockets, table_id=None, tokens=None, command="table"):
+        """Passes the sockets of a full table to the least loaded worker that takes them.
+
+        The players carry on a reopened game if there is one, or start a new one.
+        """
+        if table_id is None:
+            if self.reopening:
+                table_id, command = self.reopening.pop(0), "reopen"
+            else:
+                table_id = self.next_table_id
+                self.next_table_id += 1
+            tokens = [secrets.token_urlsafe(16) for _ in sockets]
+        message = f"{command} {table_id} {' '.join(tokens)}".encode()
+        for worker in sorted(self.workers, key=lambda worker: len(worker.tables)):
+            try:
+                socket.send_fds(worker.channel, [message], [s.fileno() for s in sockets])
+            except ConnectionError:
+                # the worker died and the lobby has not seen its channel close yet
+                self.replace_worker(worker)
+                continue
+            except OSError:
+                # its channel is full, but another worker may have room
+                continue
+            for s in sockets:
+                s.close()
+            worker.tables[table_id] = tokens
+            for token in tokens:
+                self.sessions[token] = worker
+            self.update_load()
+            print(f"table {table_id}: sent to worker {worker.index}")
+            return
+        # keep the players and offer the table again, to the new workers too
+        print(f"table {table_id}: no worker could take it, retrying")
+        asyncio.get_running_loop().call_later(DISPATCH_RETRY_DELAY, self.dispatch_table, sockets, table_id, tokens, command)
+
+def is_connected(sock):
+    """Checks whether the peer of a waiting socket is still there."""
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b""
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+
+def main():
+    parser = argparse.ArgumentParser(description="Host tables across several worker processes.")
+    parser.add_argument("--players", type=int, default=3, help="players per table")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--port", type=int, default=12330, help="port to listen on")
+    parser.add_argument("--log-dir", default="logs", help="directory for the table logs")
+    parser.add_argument("--metrics-port", type=int, default=9100, help="port of the lobby's metrics endpoint")
+    args = parser.parse_args()
+
+    metrics = m.Metrics()
+    m.MetricsServer(metrics, port=args.metrics_port).start()
+    Supervisor("localhost", args.port, args.players, args.workers, log_dir=args.log_dir, metrics=metrics).start()
+
+if __name__ == "__main__":
+    main()
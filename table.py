@@ -0,0 +1,315 @@
+import asyncio
+import contextlib
+import time
+import Hannabis as h
+import commands
+import fanout
+import metrics as m
+import protocol
+from game_state import ALL_HANDS, NO_HANDS, GameStateModel
+
+class Table:
+    """The turn flow of one game, shared by GameServer and async_server.GameTable.
+
+    Subclasses provide the transport: ask() prompts a player and waits for the
+    answer, and flush_player() sends a player their queued messages. The flow
+    is a coroutine so the event-loop server can interleave its tables; the
+    threaded server runs it on its game thread's own loop, where ask() may block.
+    """
+    # replaced by a real lock where other threads queue messages too
+    lock = contextlib.nullcontext()
+
+    def __init__(self, num_players, game_logic=None, event_log=None, metrics=None,
+                 turn_timeout=None, prompt_timeout=None, timeout_action=commands.default_timeout_action,
+                 spectator_policy=fanout.SNAPSHOT, reconnect_grace=30.0, bots=0, scheduler=None, table_id=None,
+                 spectator_hands=False):
+        self.table_id = table_id
+        self.labels = {} if table_id is None else {"table": table_id}
+        self.metrics = metrics or m.DISABLED
+        self.num_players = num_players
+        self.resumed = game_logic is not None
+        self.game_logic = game_logic or h.GameLogic(num_players)
+        self.state_model = GameStateModel(self.game_logic)
+        self.event_log = event_log
+        self.outboxes = {}
+        self.public_messages = []
+        # spectators see no hand unless the server only lets in those holding its spectator key
+        self.audience = fanout.Audience(self.state_model, policy=spectator_policy, metrics=self.metrics, table=table_id,
+                                        viewer=ALL_HANDS if spectator_hands else NO_HANDS)
+        self.turn_timeout = turn_timeout
+        self.prompt_timeout = prompt_timeout
+        self.timeout_action = timeout_action
+        self.turn_deadline = None
+        # a player who drops keeps their seat for reconnect_grace seconds
+        self.reconnect_grace = reconnect_grace
+        self.disconnected = {}
+        # each player's open prompt as (prompt ID, text); answers name the prompt they answer
+        self.prompts = {}
+        self.next_prompt_id = 1
+        # the last `bots` seats are played by the server, their moves decided by a shared bots.DecisionScheduler
+        if bots and scheduler is None:
+            raise ValueError("Bot seats need a decision scheduler.")
+        self.bot_seats = set(range(num_players - bots + 1, num_players + 1))
+        self.scheduler = scheduler
+
+    async def ask(self, player_id, prompt):
+        """Sends a prompt to a player and returns their answer."""
+        raise NotImplementedError
+
+    def flush_player(self, player_id):
+        """Sends a player their queued messages as one frame."""
+        raise NotImplementedError
+
+    def discard_responses(self, player_id):
+        """Empties a player's inbox."""
+        raise NotImplementedError
+
+    def log(self, message):
+        print(message if self.table_id is None else f"table {self.table_id}: {message}")
+
+    async def play(self):
+        """Plays the game to the end, or until a disconnected player's seat is given up, and closes the log."""
+        try:
+            await self.run_rounds()
+        except ConnectionError as e:
+            self.log(f"game stopped: {e}")
+            self.broadcast(f"{e} Game concluded.", "error", end=True)
+        if self.event_log is not None:
+            if self.game_logic.is_game_over():
+                self.event_log.append_end()
+            self.event_log.close()
+
+    async def run_rounds(self):
+        """Plays the game from the first turn to the end."""
+        self.broadcast("Resuming the game..." if self.resumed else "Starting the game...")
+        self.broadcast(f"Hello! There are {self.num_players} players in the game.")
+
+        # Assign and notify player IDs
+        for player_id in range(1, self.num_players + 1):
+            self.send_message_to_player(player_id, f"Your player ID is {player_id}.")
+            self.queue_message(player_id, self.state_model.snapshot(player_id))
+
+        # Start the rounds
+        while not self.game_logic.is_game_over():
+            player_id = self.game_logic.current_player
+            turn_started = time.perf_counter()
+            if player_id == 1:
+                self.broadcast(f"\n--- Round {self.game_logic.round} ---\n")
+            self.start_turn(player_id)
+            self.turn_deadline = time.monotonic() + self.turn_timeout if self.turn_timeout else None
+            try:
+                await self.take_turn(player_id)
+            except commands.TurnTimeout:
+                # a late answer must not stand in for the answer to their next prompt
+                self.discard_responses(player_id)
+                self.metrics.inc("turn_timeouts_total", player=player_id, **self.labels)
+                self.broadcast(f"Player {player_id} ran out of time.", "error")
+                self.apply_command(player_id, self.timeout_action(self.game_logic, player_id))
+
+            self.metrics.observe("turn_seconds", time.perf_counter() - turn_started, **self.labels)
+            if self.game_logic.is_game_over():
+                self.log("game over")
+                break
+            self.game_logic.advance_turn()
+        self.broadcast(self.game_logic.get_game_over_reason(), "result")
+        self.broadcast("Game concluded.", end=True)
+
+    async def take_turn(self, player_id):
+        """ask the player for their move and do it"""
+        if player_id in self.bot_seats:
+            # the others see the turn start while the scheduler decides
+            self.flush()
+            self.apply_command(player_id, await asyncio.wrap_future(self.scheduler.submit(self.game_logic, player_id)))
+            return
+        action = await self.get_player_action(player_id)
+        # Do the action
+        if isinstance(action, tuple):
+            self.apply_command(player_id, action)
+
+        elif action == "play_card" or action == "1":
+            card = await self.which_card_to_play(player_id)
+            self.play_card_action(player_id, card)
+
+        elif action == "give_info" or action == "2":
+            await self.give_information_action(player_id)
+
+    async def get_player_action(self, player_id):
+        """ask and check for player action, which may be a whole turn such as 'give 3 Red'"""
+        valid_actions = {"1", "2", "play_card", "give_info"}
+        while True:
+            action = await self.ask(player_id, "Choose action (1: play_card, 2: give_info): ")
+            if action in valid_actions:
+                return action
+            try:
+                command = commands.parse_turn_command(action, self.game_logic, player_id)
+            except ValueError as e:
+                self.reject_input(player_id, str(e))
+                continue
+            if command is None:
+                self.reject_input(player_id, "Invalid action. Please enter '1' for play_card or '2' for give_info.")
+            elif command in self.game_logic.legal_actions(player_id):
+                return command
+            else:
+                self.reject_input(player_id, "That move is not possible right now.")
+
+    def apply_command(self, player_id, command):
+        """do a move given as an engine action"""
+        if command is None:
+            return
+        if command[0] == 'play':
+            self.play_card_action(player_id, chr(ord('a') + command[1]))
+        else:
+            self.give_information(player_id, command[1], command[2])
+
+    async def which_card_to_play(self, player_id):
+        """ask and check for which card to play"""
+        valid_cards = {"a", "b", "c", "d", "e"}
+        while True:
+            card = await self.ask(player_id, "Which card to play (a-e): ")
+            if card in valid_cards:
+                return card
+            self.reject_input(player_id, "Invalid card. Please enter a valid card (a-e).")
+
+    def play_card_action(self, player_id, card_letter):
+        """play and check for card action"""
+        try:
+            events = self.game_logic.apply_play(player_id, ord(card_letter.lower()) - ord('a'))
+        except ValueError:
+            self.broadcast(f"Player {player_id}: Invalid card selection.", "error")
+            return
+        self.record(events)
+        _, _, _, card, success = events[0]
+        if success:
+            self.broadcast(f"Player {player_id} played {card} successfully.", "result")
+        else:
+            self.broadcast(f"Player {player_id} played {card}, but it was not valid.", "result")
+
+    async def ask_for_target_player_id(self, current_player_id):
+        """ask and check for target player id"""
+        valid_ids = [str(id) for id in range(1, self.num_players + 1) if id != current_player_id]
+        while True:
+            target_id = await self.ask(current_player_id, f"Enter the target player ID to give information to (options: {', '.join(valid_ids)}): ")
+            if target_id in valid_ids:
+                return int(target_id)
+            self.reject_input(current_player_id, "Invalid player ID. Please choose from the given options.")
+
+    async def ask_for_information_type(self, current_player_id):
+        """ask and check for information type"""
+        valid_colors = self.game_logic.get_valid_colors()
+        while True:
+            info = await self.ask(current_player_id, "Enter the information to give (color or number): ")
+            if info.isdigit() and 1 <= int(info) <= 5:
+                return info
+            elif info.capitalize() in valid_colors:
+                return info.capitalize()
+            self.reject_input(current_player_id, "Invalid information type. Please enter a valid color or number.")
+
+    async def give_information_action(self, current_player_id):
+        """give and check for information action"""
+        if self.game_logic.shared_tokens['info_tokens'] <= 0:
+            self.broadcast("No information tokens available.", "error")
+            return
+
+        target_player_id = await self.ask_for_target_player_id(current_player_id)
+        info = await self.ask_for_information_type(current_player_id)
+        self.give_information(current_player_id, target_player_id, info)
+
+    def give_information(self, current_player_id, target_player_id, info):
+        """give a hint and tell the players about it"""
+        try:
+            events = self.game_logic.apply_hint(current_player_id, target_player_id, info)
+        except ValueError:
+            self.reject_input(current_player_id, "Invalid information provided. Please try again.")
+        else:
+            card_positions = ', '.join(events[0][4]).lower()
+            self.record(events)
+            self.send_message_to_player(target_player_id, f"Player {target_player_id}, your cards {card_positions} are {info}.", "result")
+            self.broadcast(f"Information tokens left: {self.game_logic.shared_tokens['info_tokens']}", "result")
+
+    def start_turn(self, player_id):
+        """announce the turn to the players and the log"""
+        # Players keep their own view of the table up to date from deltas
+        self.broadcast_update(self.state_model.start_turn(player_id))
+        if self.event_log is not None:
+            self.event_log.append_turn(player_id, self.game_logic.round)
+            self.event_log.flush()
+
+    def record(self, events):
+        """send the events of an action to the players and the log"""
+        self.broadcast_update(*self.state_model.record(events))
+        if self.event_log is not None:
+            self.event_log.append_events(events)
+
+    def prompt_player(self, player_id, prompt):
+        """send a prompt to a player along with everything still queued"""
+        self.prompts[player_id] = (self.next_prompt_id, prompt)
+        self.next_prompt_id += 1
+        self.send_message_to_player(player_id, prompt, "prompt", id=self.prompts[player_id][0])
+        self.flush()
+
+    def answers_open_prompt(self, player_id, prompt_id):
+        """checks that a response answers the player's open prompt; responses that name no prompt always do"""
+        return prompt_id is None or prompt_id == self.prompts[player_id][0]
+
+    def mark_disconnected(self, player_id):
+        """keep a dropped player's seat for reconnect_grace seconds and tell the others"""
+        self.disconnected[player_id] = time.monotonic()
+        self.metrics.inc("disconnects_total", player=player_id, **self.labels)
+        self.broadcast(f"Player {player_id} disconnected. Their seat is kept for {self.reconnect_grace:g} seconds.", "error")
+
+    def mark_reconnected(self, player_id):
+        """send a returning player one snapshot of their view, and their prompt if they have one"""
+        self.disconnected.pop(player_id, None)
+        with self.lock:
+            # the snapshot stands in for every update they missed
+            self.outboxes[player_id] = [self.state_model.snapshot(player_id)]
+        self.metrics.inc("reconnects_total", player=player_id, **self.labels)
+        self.log(f"player {player_id} reconnected")
+        self.broadcast(f"Player {player_id} reconnected.")
+        if player_id in self.prompts:
+            # their prompt was lost with the old connection
+            prompt_id, prompt = self.prompts[player_id]
+            self.send_message_to_player(player_id, prompt, "prompt", id=prompt_id)
+
+    def broadcast(self, message, message_type="text", **fields):
+        """queue a message for all players"""
+        message = protocol.make_message(message_type, message, **fields)
+        with self.metrics.timer("broadcast_seconds", **self.labels):
+            with self.lock:
+                for outbox in self.outboxes.values():
+                    outbox.append(message)
+                self.public_messages.append(message)
+
+    def send_message_to_player(self, player_id, message, message_type="text", **fields):
+        """queue a message for a player"""
+        self.queue_message(player_id, protocol.make_message(message_type, message, **fields))
+
+    def queue_message(self, player_id, message):
+        """queue an already built message for a player"""
+        self.metrics.inc("messages_total", player=player_id, **self.labels)
+        with self.lock:
+            # bot seats have no outbox
+            outbox = self.outboxes.get(player_id)
+            if outbox is not None:
+                outbox.append(message)
+
+    def reject_input(self, player_id, message):
+        """tell a player their input was invalid"""
+        self.metrics.inc("invalid_inputs_total", player=player_id, **self.labels)
+        self.send_message_to_player(player_id, message, "error")
+
+    def broadcast_update(self, delta, hidden=None):
+        """queue a state delta for all players and the spectators, using the hidden variant where given"""
+        hidden = hidden or {}
+        with self.lock:
+            for player_id, outbox in self.outboxes.items():
+                outbox.append(hidden.get(player_id, delta))
+            self.public_messages.append(hidden.get(self.audience.viewer, delta))
+
+    def flush(self):
+        """send every player their queued messages as one frame, and the public ones to the spectators"""
+        for player_id in list(self.outboxes):
+            self.flush_player(player_id)
+        with self.lock:
+            messages, self.public_messages = self.public_messages, []
+        self.audience.publish(messages)
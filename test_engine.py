@@ -0,0 +1,78 @@
+import random
+import unittest
+import numpy as np
+import Hannabis as h
+from batch_engine import BatchGame, HAND_SIZE, encode_hint
+
+def state(game):
+    """Returns everything apply and undo may change, for comparing games."""
+    return dict(vars(game))
+
+def play_random_games(count, seed=0):
+    """Yields (game, rng) for seeded games of every player count, played to the end by the caller."""
+    rng = random.Random(seed)
+    for i in range(count):
+        yield h.GameLogic(2 + i % 4, seed=rng.randrange(1 << 30)), rng
+
+
+class UndoTest(unittest.TestCase):
+    def test_undo_reverts_every_legal_action(self):
+        for game, rng in play_random_games(60):
+            while not game.is_game_over():
+                actions = game.legal_actions(game.current_player)
+                if not actions:
+                    break
+                before = state(game.clone())
+                for action in actions:
+                    record = game.apply(action)
+                    game.undo(record)
+                    self.assertEqual(state(game), before, action)
+                game.apply(rng.choice(actions))
+
+    def test_clone_shares_no_state(self):
+        for game, rng in play_random_games(20, seed=2):
+            before = state(game.clone())
+            copy = game.clone()
+            while not copy.is_game_over() and copy.legal_actions(copy.current_player):
+                copy.apply(rng.choice(copy.legal_actions(copy.current_player)))
+            self.assertEqual(state(game), before)
+
+
+class BatchParityTest(unittest.TestCase):
+    def encode_action(self, game, action):
+        """Returns the batch_engine action code of a GameLogic action of the current player."""
+        if action[0] == 'play':
+            return action[1]
+        return encode_hint((action[1] - game.current_player) % game.number_of_players, action[2])
+
+    def assert_same_state(self, game, batch):
+        for player_id, hand in game.shared_hands.items():
+            codes = [card.code for card in hand] + [-1] * (HAND_SIZE - len(hand))
+            self.assertEqual(batch.hands[0, player_id - 1].tolist(), codes)
+        self.assertEqual(batch.info_tokens[0], game.shared_tokens['info_tokens'])
+        self.assertEqual(batch.fuse_tokens[0], game.shared_tokens['fuse_tokens'])
+        self.assertEqual(batch.fireworks[0].tolist(), [game.fireworks[color] for color in h.COLORS[:game.number_of_players]])
+        self.assertEqual(batch.score[0], game.score)
+        self.assertEqual(batch.current_player[0], game.current_player - 1)
+        self.assertEqual(batch.done[0], game.is_game_over())
+
+    def test_batch_engine_matches_game_logic(self):
+        for game, rng in play_random_games(60, seed=1):
+            # GameLogic deals from the end of its deck, BatchGame from the front
+            batch = BatchGame(1, game.number_of_players, decks=[[card.code for card in reversed(game.initial_deck)]])
+            self.assert_same_state(game, batch)
+            while not game.is_game_over():
+                actions = game.legal_actions(game.current_player)
+                legal = np.flatnonzero(batch.legal_action_mask()[0]).tolist()
+                self.assertEqual(sorted(self.encode_action(game, action) for action in actions), legal)
+                if not actions:
+                    break
+                action = rng.choice(actions)
+                valid, success = batch.apply_actions([self.encode_action(game, action)])
+                events = game.step(action)
+                self.assertTrue(valid[0])
+                self.assertEqual(success[0], action[0] == 'play' and events[0][4])
+                self.assert_same_state(game, batch)
+
+if __name__ == "__main__":
+    unittest.main()
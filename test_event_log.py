@@ -0,0 +1,108 @@
+import os
+import random
+import tempfile
+import unittest
+import Hannabis as h
+from event_log import HEADER, RECORD, EventLogReader, EventLogWriter
+
+def state(game):
+    """Returns everything replay rebuilds, for comparing games."""
+    return dict(vars(game))
+
+def log_turn(writer, game, action):
+    """Logs and plays one turn the way table.Table does."""
+    writer.append_turn(game.current_player, game.round)
+    writer.append_events(game.step(action))
+
+
+class CrashRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "table-1.hlog")
+        self.rng = random.Random(7)
+
+    def random_action(self, game):
+        """Picks a random move, mostly hints, so games last long enough to crash in."""
+        actions = game.legal_actions(game.current_player)
+        hints = [action for action in actions if action[0] == 'hint']
+        return self.rng.choice(hints if hints and self.rng.random() < 0.8 else actions)
+
+    def write_turns(self, game, turns):
+        """Logs turns of game, returning the state at the start of every turn."""
+        writer = EventLogWriter(self.path, game)
+        states = []
+        for _ in range(turns):
+            if game.is_game_over():
+                break
+            states.append(state(game.clone()))
+            log_turn(writer, game, self.random_action(game))
+        writer.close()
+        return states
+
+    def replay(self, to_turn=None):
+        reader = EventLogReader(self.path)
+        try:
+            return reader.replay(to_turn)
+        finally:
+            reader.close()
+
+    def test_replay_to_any_turn(self):
+        game = h.GameLogic(3, seed=1)
+        states = self.write_turns(game, 12)
+        for turn, expected in enumerate(states):
+            self.assertEqual(state(self.replay(turn)), expected, turn)
+        self.assertEqual(state(self.replay()), state(game))
+
+    def test_resume_after_torn_record(self):
+        game = h.GameLogic(4, seed=2)
+        self.write_turns(game, 8)
+        self.assertFalse(game.is_game_over())
+        # the crash tears the record of the next turn halfway through
+        size = os.path.getsize(self.path)
+        with open(self.path, "ab") as f:
+            f.write(RECORD.pack(1, game.current_player, 0, 0, 0, game.round)[:RECORD.size // 2])
+        replayed = self.replay()
+        self.assertEqual(state(replayed), state(game))
+
+        writer = EventLogWriter(self.path, replayed, resume=True)
+        self.assertEqual(os.path.getsize(self.path), size)
+        while not game.is_game_over():
+            action = self.random_action(game)
+            log_turn(writer, game, action)
+        writer.append_end()
+        writer.close()
+
+        reader = EventLogReader(self.path)
+        self.assertTrue(reader.is_finished())
+        self.assertEqual(state(reader.replay()), state(game))
+        reader.close()
+
+    def test_resume_after_turn_without_action(self):
+        game = h.GameLogic(2, seed=3)
+        states = self.write_turns(game, 6)
+        self.assertFalse(game.is_game_over())
+        # the crash comes after the turn was announced but before its move
+        writer = EventLogWriter(self.path, game, resume=True)
+        writer.append_turn(game.current_player, game.round)
+        writer.close()
+        replayed = self.replay()
+        self.assertEqual(state(replayed), state(game))
+
+        # the resumed table announces the same turn again
+        writer = EventLogWriter(self.path, replayed, resume=True)
+        for _ in range(4):
+            if game.is_game_over():
+                break
+            log_turn(writer, game, self.random_action(game))
+        writer.close()
+        self.assertEqual(state(self.replay()), state(game))
+        for turn, expected in enumerate(states):
+            self.assertEqual(state(self.replay(turn)), expected, turn)
+
+    def test_log_torn_inside_header_holds_no_game(self):
+        with open(self.path, "wb") as f:
+            f.write(b"\0" * (HEADER.size - 1))
+        with self.assertRaises(ValueError):
+            EventLogReader(self.path)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import Hannabis as h
+import fanout
+import protocol
+from game_state import ALL_HANDS, NO_HANDS, GameStateModel, GameView
+
+class FakeSender:
+    """Runs calls at once instead of on a sender thread."""
+    def call(self, function):
+        function()
+
+class FakeConnection:
+    """Records written frames; its buffer only drains when the test says so."""
+    def __init__(self):
+        self.sender = FakeSender()
+        self.frames = []
+        self.buffered_bytes = 0
+        self.closing = False
+        self.closed = False
+
+    def write(self, frame):
+        self.frames.append(frame)
+        self.buffered_bytes += len(frame)
+
+    def buffered(self):
+        return self.buffered_bytes
+
+    def close(self):
+        self.closing = True
+
+
+class AudienceTest(unittest.TestCase):
+    def setUp(self):
+        self.audience = fanout.Audience(GameStateModel(h.GameLogic(3, seed=1)), max_buffer=1000)
+        self.connection = FakeConnection()
+        self.audience.add(self.connection)
+        self.spectator = self.audience.spectators[0]
+
+    def publish(self, text="update"):
+        self.audience.publish([protocol.make_message("text", text)])
+
+    def test_stalled_spectator_resyncs_once_drained(self):
+        self.publish()
+        self.assertFalse(self.spectator.stale)
+        self.connection.buffered_bytes = 1000
+        self.publish()
+        self.assertTrue(self.spectator.stale)
+        # still stalled when the snapshot is taken, so it cannot be sent yet
+        self.publish()
+        self.assertTrue(self.spectator.stale)
+        sent = len(self.connection.frames)
+        self.connection.buffered_bytes = 0
+        self.publish()
+        self.assertFalse(self.spectator.stale)
+        self.assertEqual(len(self.connection.frames), sent + 1)
+        self.publish("after")
+        self.assertEqual(self.connection.frames[-1], protocol.encode_frame([protocol.make_message("text", "after")]))
+
+    def test_disconnect_policy_closes_a_stalled_spectator(self):
+        self.audience.policy = fanout.DISCONNECT
+        self.publish()
+        self.connection.buffered_bytes = 1000
+        self.publish()
+        self.assertTrue(self.connection.closing)
+
+
+class SpectatorViewTest(unittest.TestCase):
+    def test_spectators_see_no_hand_by_default(self):
+        game = h.GameLogic(3, seed=1)
+        model = GameStateModel(game)
+        snapshot = model.snapshot(NO_HANDS)
+        self.assertTrue(all(card is None for hand in snapshot["hands"].values() for card in hand))
+        delta, hidden = model.record(game.step(('play', 0)))
+        self.assertIsNotNone(delta["changes"][-1]["card"])
+        self.assertIsNone(hidden[NO_HANDS]["changes"][-1]["card"])
+        view = GameView()
+        view.apply(snapshot)
+        view.apply(hidden[NO_HANDS])
+        self.assertIn("Player 1: ??, ??, ??, ??, ??", view.render())
+
+    def test_spectators_with_the_key_see_every_hand(self):
+        game = h.GameLogic(3, seed=1)
+        snapshot = GameStateModel(game).snapshot(ALL_HANDS)
+        self.assertTrue(all(card is not None for hand in snapshot["hands"].values() for card in hand))
+
+    def test_key_matches(self):
+        self.assertTrue(fanout.key_matches("secret", "secret"))
+        self.assertFalse(fanout.key_matches("guess", "secret"))
+        self.assertFalse(fanout.key_matches(None, "secret"))
+
+if __name__ == "__main__":
+    unittest.main()
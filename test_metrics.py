@@ -0,0 +1,27 @@
+import unittest
+import metrics as m
+
+class RemoveTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = m.Metrics()
+        for table in (1, 2):
+            self.metrics.inc("messages_total", 3, table=table, player=1)
+            self.metrics.set("spectators", 2, table=table)
+            self.metrics.observe("turn_seconds", 0.002, table=table)
+
+    def test_finished_table_is_folded_into_totals(self):
+        self.metrics.remove(table=1)
+        self.assertNotIn('table="1"', self.metrics.render())
+        self.assertEqual(self.metrics.counters[("messages_total", (("player", 1),))], 3)
+        self.assertEqual(self.metrics.histograms[("turn_seconds", ())][2], 1)
+        self.assertNotIn(("spectators", ()), self.metrics.counters)
+
+    def test_series_stay_bounded_across_tables(self):
+        self.metrics.remove(table=1)
+        self.metrics.remove(table=2)
+        self.assertEqual(self.metrics.counters[("messages_total", (("player", 1),))], 6)
+        self.assertEqual(self.metrics.histograms[("turn_seconds", ())][2], 2)
+        self.assertEqual(len(self.metrics.counters), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import Hannabis as h
+import protocol
+from commands import parse_turn_command
+
+def frame(*texts):
+    """Returns the encoded frame of a response per text."""
+    return protocol.encode_frame([protocol.make_message("response", text) for text in texts])
+
+
+class FrameDecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.decoder = protocol.FrameDecoder()
+
+    def test_frame_split_across_reads(self):
+        data = frame("play a")
+        for i in range(len(data) - 1):
+            self.assertEqual(self.decoder.feed(data[i:i + 1]), [])
+        self.assertEqual(self.decoder.feed(data[-1:]), [protocol.make_message("response", "play a")])
+        self.assertEqual(self.decoder.buffer, b"")
+
+    def test_frames_joined_in_one_read(self):
+        data = frame("1", "a") + frame("2") + frame("3")[:5]
+        self.assertEqual([message["text"] for message in self.decoder.feed(data)], ["1", "a", "2"])
+        self.assertEqual([message["text"] for message in self.decoder.feed(frame("3")[5:])], ["3"])
+
+    def test_blank_lines_and_single_messages(self):
+        data = b"\n" + b'{"type":"response","text":"1"}\n'
+        self.assertEqual(self.decoder.feed(data), [protocol.make_message("response", "1")])
+
+    def test_oversized_frame_is_dropped(self):
+        decoder = protocol.FrameDecoder(max_frame_size=64)
+        with self.assertRaises(protocol.ProtocolError):
+            decoder.feed(b"[" * 65)
+        # the decoder starts over with the next frame
+        self.assertEqual(decoder.feed(frame("1")), [protocol.make_message("response", "1")])
+
+    def test_malformed_frames_are_rejected(self):
+        for line in (b"not json\n", b"[1, 2]\n", b'[{"type": "unknown"}]\n', b'"text"\n'):
+            with self.assertRaises(protocol.ProtocolError, msg=line):
+                protocol.FrameDecoder().feed(line)
+
+    def test_unknown_message_type_cannot_be_made(self):
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.make_message("shout", "hi")
+
+
+class TurnCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.game = h.GameLogic(3, seed=1)
+
+    def test_whole_turn_commands(self):
+        self.assertEqual(parse_turn_command("play a", self.game, 1), ('play', 0))
+        self.assertEqual(parse_turn_command("PLAY E", self.game, 1), ('play', 4))
+        self.assertEqual(parse_turn_command("give 2 red", self.game, 1), ('hint', 2, 'Red'))
+        self.assertEqual(parse_turn_command("hint 3 4", self.game, 1), ('hint', 3, '4'))
+
+    def test_answers_to_step_by_step_prompts_are_not_commands(self):
+        for text in ("", "1", "a", "Red", "  "):
+            self.assertIsNone(parse_turn_command(text, self.game, 1), text)
+
+    def test_malformed_commands(self):
+        for text in ("play", "play f", "play ab", "play a b", "give", "give 2", "give two Red",
+                     "give 2 Purple", "give 2 6", "give 2 0", "hint 2 Red now"):
+            with self.assertRaises(ValueError, msg=text):
+                parse_turn_command(text, self.game, 1)
+
+if __name__ == "__main__":
+    unittest.main()